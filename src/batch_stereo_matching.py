@@ -0,0 +1,173 @@
+# Tobit Flatscher - github.com/2b-t (2022)
+
+# @file batch_stereo_matching.py
+# @brief Interface class for stereo matching of many small image pairs at once
+
+import numpy as np
+from typing import Dict, Tuple
+
+from matching_algorithm.matching_algorithm import MatchingAlgorithm
+from matching_cost.matching_cost import MatchingCost
+from parallel import Backend, Parallel
+from utilities import PeakMemory
+
+
+class BufferPool:
+  # Pool of scratch buffers that are reused between calls instead of being allocated again
+
+  def __init__(self):
+    # Class constructor
+
+    self._buffers: Dict[str, np.ndarray] = {}
+    return
+
+  def get(self, name: str, shape: Tuple[int, ...], dtype: type) -> np.ndarray:
+    # Get an uninitialised scratch buffer, a larger buffer of the same name is reused if only its first dimension differs
+    #   @param[in] name: The name of the buffer
+    #   @param[in] shape: The shape of the buffer
+    #   @param[in] dtype: The data type of the buffer
+    #   @return: The scratch buffer
+
+    buffer = self._buffers.get(name)
+    if (buffer is None) or (buffer.dtype != np.dtype(dtype)) or (buffer.shape[1:] != tuple(shape[1:])) or (buffer.shape[0] < shape[0]):
+      buffer = np.empty(shape, dtype)
+      self._buffers[name] = buffer
+    return buffer[:shape[0]]
+
+  def clear(self) -> None:
+    # Release all scratch buffers
+
+    self._buffers.clear()
+    return
+
+  def size(self) -> int:
+    # Get the memory held by the pool
+    #   @return: The memory of all scratch buffers in bytes
+
+    return sum(buffer.nbytes for buffer in self._buffers.values())
+
+
+class BatchStereoMatching:
+  # Recreate the depth images of a stack of image pairs of the same size with a given maximum disparity and filter radius
+  # The matching cost and algorithm run in a single parallel kernel over all pairs and scratch buffers are reused between calls
+
+  def __init__(self, matching_cost: MatchingCost,
+                     matching_algorithm: MatchingAlgorithm,
+                     max_disparity: int = 60, filter_radius: int = 3,
+                     num_threads: int = None, chunk_size: int = None, memory_budget: int = None,
+                     buffer_pool: BufferPool = None):
+    # Class constructor
+    #   @param[in] matching_cost: The class implementing the matching cost
+    #   @param[in] matching_algorithm: The class implementing the matching algorithm
+    #   @param[in] max_disparity: The maximum disparity to consider
+    #   @param[in] filter_radius: The radius of the filter
+    #   @param[in] num_threads: The number of threads to be used, None for the maximum number of threads
+    #   @param[in] chunk_size: The number of pairs whose cost volumes are kept in memory at once, None for four per thread
+    #   @param[in] memory_budget: The maximum memory in bytes to be allocated for the cost volumes kept in memory at once,
+    #                             reduces the chunk size accordingly, None for unlimited
+    #   @param[in] buffer_pool: The pool of scratch buffers, e.g. shared with other stereo matchings of the same thread, None for a new one
+
+    if (max_disparity <= 0):
+      raise ValueError("Maximum disparity (" + str(max_disparity) + ") has to be greater than zero.")
+    if (filter_radius <= 0):
+      raise ValueError("Radius (" + str(filter_radius) + ") has to be greater than zero.")
+    if num_threads is None:
+      num_threads = Parallel.max_threads()
+    Parallel.check_backend(Backend.NUMBA, num_threads)
+    if chunk_size is None:
+      chunk_size = 4*num_threads
+    if (chunk_size <= 0):
+      raise ValueError("Chunk size (" + str(chunk_size) + ") has to be greater than zero.")
+    if (memory_budget is not None) and (memory_budget <= 0):
+      raise ValueError("Memory budget (" + str(memory_budget) + ") has to be greater than zero.")
+
+    self._matching_cost = matching_cost
+    self._matching_algorithm = matching_algorithm
+    self._max_disparity = max_disparity
+    self._filter_radius = filter_radius
+    self._num_threads = num_threads
+    self._chunk_size = chunk_size
+    self._memory_budget = memory_budget
+    self._buffer_pool = buffer_pool if buffer_pool is not None else BufferPool()
+    return
+
+  def compute(self, left_images: np.ndarray, right_images: np.ndarray) -> np.ndarray:
+    # Compute the disparity images of a stack of image pairs
+    #   @param[in] left_images: The left stereo images (N,H,W)
+    #   @param[in] right_images: The right stereo images (N,H,W)
+    #   @return: The disparity images (N,H,W)
+
+    if (left_images.ndim != 3):
+      raise ValueError("The left images have to be a stack of grey-scale images (N,H,W).")
+    if (right_images.ndim != 3):
+      raise ValueError("The right images have to be a stack of grey-scale images (N,H,W).")
+    if (left_images.shape != right_images.shape):
+      raise ValueError("Dimensions of left " + str(left_images.shape) + " and right images " + str(right_images.shape) + " do not match.")
+
+    is_fused = self._matching_cost.is_fusable and self._matching_algorithm.is_fusable
+    dtype = self._get_dtype(left_images.dtype.type, is_fused)
+    left_images = np.ascontiguousarray(left_images, dtype=dtype)
+    right_images = np.ascontiguousarray(right_images, dtype=dtype)
+    (N,H,W) = left_images.shape
+    disparity_images = np.empty((N,H,W), dtype=np.int64)
+    Parallel.map(self._run, [(left_images, right_images, disparity_images, is_fused)], Backend.NUMBA, self._num_threads)
+    return disparity_images
+
+  def buffer_pool(self) -> BufferPool:
+    # Get the pool of scratch buffers, e.g. for releasing them
+    #   @return: The pool of scratch buffers
+
+    return self._buffer_pool
+
+  def _run(self, left_images: np.ndarray, right_images: np.ndarray, disparity_images: np.ndarray, is_fused: bool) -> None:
+    # Compute the disparity images, either fused or in chunks of cost volumes
+    #   @param[in] left_images: The left stereo images converted to the data type of the kernels (N,H,W)
+    #   @param[in] right_images: The right stereo images converted to the data type of the kernels (N,H,W)
+    #   @param[out] disparity_images: The pre-allocated disparity images to be overwritten (N,H,W)
+    #   @param[in] is_fused: Flag for fusing the matching cost with a winner-takes-it-all search
+
+    if is_fused:
+      self._matching_cost.compute_wta_batch(left_images, right_images, self._max_disparity, self._filter_radius, disparity_images)
+      return
+
+    (N,H,W) = left_images.shape
+    chunk_size = self._get_chunk_size((H,W), left_images.dtype.type)
+    for start in range(0, N, chunk_size):
+      end = min(start + chunk_size, N)
+      cost_volumes = self._buffer_pool.get("cost_volumes", (end - start, H, W, self._max_disparity), left_images.dtype)
+      self._matching_cost.compute_batch(left_images[start:end], right_images[start:end], self._max_disparity, self._filter_radius, cost_volumes)
+      self._matching_algorithm.match_batch(cost_volumes, disparity_images[start:end], self._buffer_pool.get)
+    return
+
+  def _get_chunk_size(self, image_shape: Tuple[int, int], dtype: type) -> int:
+    # Choose the number of pairs whose cost volumes are kept in memory at once so that they stay within the memory budget
+    #   @param[in] image_shape: The shape of the images (H,W)
+    #   @param[in] dtype: The floating point type the images are processed in
+    #   @return: The number of pairs processed at once
+
+    if self._memory_budget is None:
+      return self._chunk_size
+
+    (H,W) = image_shape
+    D = self._max_disparity
+    pair_memory = self._matching_cost.estimate_memory((H,W), D, dtype) + self._matching_algorithm.estimate_memory((H,W,D), dtype)
+    if pair_memory > self._memory_budget:
+      raise MemoryError("Stereo matching of a single pair requires an estimated peak memory of " + PeakMemory.str_megabytes(pair_memory) +
+                        " which exceeds the memory budget of " + PeakMemory.str_megabytes(self._memory_budget) + ".")
+    return min(self._chunk_size, self._memory_budget//pair_memory)
+
+  def _get_dtype(self, image_dtype: type, is_fused: bool) -> type:
+    # Choose the data type of the kernels, keeping the data type of the images if possible to avoid a conversion
+    #   @param[in] image_dtype: The data type of the images
+    #   @param[in] is_fused: Flag for fusing the matching cost with a winner-takes-it-all search
+    #   @return: The floating point type the images are processed in
+
+    supported_dtypes = self._matching_cost.supported_dtypes
+    if not is_fused:
+      supported_dtypes = tuple(t for t in supported_dtypes if t in self._matching_algorithm.supported_dtypes)
+    if not supported_dtypes:
+      raise ValueError("Matching cost '" + str(self._matching_cost.name) + "' and matching algorithm '" +
+                       str(self._matching_algorithm.name) + "' do not share a common data type.")
+    if image_dtype in supported_dtypes:
+      return image_dtype
+    return max(supported_dtypes, key=lambda t: np.dtype(t).itemsize)
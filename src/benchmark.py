@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# Tobit Flatscher - github.com/2b-t (2022)
+
+# @file benchmark.py
+# @brief Command line interface for benchmarking the scaling of stereo matching with the number of threads
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import numpy as np
+import time
+from typing import List
+
+from matching_algorithm import MatchingAlgorithm
+from matching_cost import MatchingCost
+from parallel import Backend, Parallel
+from stereo_matching import StereoMatching
+from utilities import IO
+
+
+def main(left_image_path: str, right_image_path: str,
+         matching_algorithm_name: str, matching_cost_name: str,
+         max_disparity: int, filter_radius: int,
+         max_threads: int, backend_names: List[str], number_of_repetitions: int, is_jobs: bool = True) -> None:
+  # Measures the run time of stereo matching for 1..N threads for every backend
+  # as well as the throughput of several concurrent jobs sharing N threads
+  #   @param[in] left_image_path:          Path to the image for the left eye
+  #   @param[in] right_image_path:         Path to the image for the right eye
+  #   @param[in] matching_algorithm_name:  Name of the matching algorithm
+  #   @param[in] matching_cost_name:       Name of the matching cost type
+  #   @param[in] max_disparity:            Maximum disparity to consider
+  #   @param[in] filter_radius:            Filter radius to be considered for cost volume
+  #   @param[in] max_threads:              Maximum number of threads N
+  #   @param[in] backend_names:            Names of the parallel backends to be benchmarked
+  #   @param[in] number_of_repetitions:    Number of repetitions, the fastest one is reported
+  #   @param[in] is_jobs:                  Flag for turning the benchmark of concurrent jobs on and off
+
+  left_image = IO.import_image(left_image_path)
+  right_image = IO.import_image(right_image_path)
+
+  print("Scaling with the number of threads (" + matching_cost_name + ", " + matching_algorithm_name + "):")
+  print("{:>10} {:>8} {:>10} {:>8} {:>10}".format("backend", "threads", "time [s]", "speed-up", "efficiency"))
+  for backend_name in backend_names:
+    reference_time = None
+    for num_threads in range(1, max_threads + 1):
+      try:
+        run_time = _measure(left_image, right_image, matching_cost_name, matching_algorithm_name,
+                            max_disparity, filter_radius, num_threads, Backend(backend_name), number_of_repetitions)
+      except ValueError as e:
+        print("{:>10} {}".format(backend_name, e))
+        break
+      if reference_time is None:
+        reference_time = run_time
+      speed_up = reference_time/run_time
+      print("{:>10} {:>8} {:>10.3f} {:>8.2f} {:>10.2f}".format(backend_name, num_threads, run_time, speed_up, speed_up/num_threads))
+
+  if is_jobs is True:
+    print("Throughput of concurrent jobs sharing " + str(max_threads) + " threads (numba backend):")
+    print("{:>10} {:>8} {:>12}".format("jobs", "threads", "pairs/s"))
+    for number_of_jobs in [j for j in range(1, max_threads + 1) if max_threads % j == 0]:
+      num_threads = max_threads//number_of_jobs
+      throughput = _measure_jobs(left_image, right_image, matching_cost_name, matching_algorithm_name,
+                                 max_disparity, filter_radius, num_threads, number_of_jobs, number_of_repetitions)
+      print("{:>10} {:>8} {:>12.3f}".format(number_of_jobs, num_threads, throughput))
+  return
+
+
+def _measure(left_image: np.ndarray, right_image: np.ndarray,
+             matching_cost_name: str, matching_algorithm_name: str,
+             max_disparity: int, filter_radius: int,
+             num_threads: int, backend: Backend, number_of_repetitions: int, barrier = None) -> float:
+  # Measure the fastest run time of stereo matching after compiling the kernels and starting the pool of threads or processes
+  #   @param[in] left_image:               The left stereo image (H,W)
+  #   @param[in] right_image:              The right stereo image (H,W)
+  #   @param[in] matching_cost_name:       Name of the matching cost type
+  #   @param[in] matching_algorithm_name:  Name of the matching algorithm
+  #   @param[in] max_disparity:            Maximum disparity to consider
+  #   @param[in] filter_radius:            Filter radius to be considered for cost volume
+  #   @param[in] num_threads:              Number of threads or processes
+  #   @param[in] backend:                  The parallel backend
+  #   @param[in] number_of_repetitions:    Number of repetitions
+  #   @param[in] barrier:                  Barrier for starting the measurement of concurrent jobs at the same time
+  #   @return: The fastest run time in seconds
+
+  run_times = []
+  with StereoMatching(left_image, right_image, MatchingCost.from_name(matching_cost_name), MatchingAlgorithm.from_name(matching_algorithm_name),
+                      max_disparity, filter_radius, None, num_threads, backend) as sm:
+    sm.compute()
+    if barrier is not None:
+      barrier.wait()
+
+    for _ in range(number_of_repetitions):
+      start_time = time.perf_counter()
+      sm.compute()
+      run_times.append(time.perf_counter() - start_time)
+  return min(run_times)
+
+
+def _measure_jobs(left_image: np.ndarray, right_image: np.ndarray,
+                  matching_cost_name: str, matching_algorithm_name: str,
+                  max_disparity: int, filter_radius: int,
+                  num_threads: int, number_of_jobs: int, number_of_repetitions: int) -> float:
+  # Measure the throughput of several processes performing stereo matching at the same time
+  #   @param[in] left_image:               The left stereo image (H,W)
+  #   @param[in] right_image:              The right stereo image (H,W)
+  #   @param[in] matching_cost_name:       Name of the matching cost type
+  #   @param[in] matching_algorithm_name:  Name of the matching algorithm
+  #   @param[in] max_disparity:            Maximum disparity to consider
+  #   @param[in] filter_radius:            Filter radius to be considered for cost volume
+  #   @param[in] num_threads:              Number of threads of every job
+  #   @param[in] number_of_jobs:           Number of concurrent jobs
+  #   @param[in] number_of_repetitions:    Number of repetitions of every job
+  #   @return: The number of stereo pairs processed per second by all jobs together
+
+  context = multiprocessing.get_context("spawn")
+  with context.Manager() as manager:
+    barrier = manager.Barrier(number_of_jobs)
+    with ProcessPoolExecutor(number_of_jobs, mp_context=context) as executor:
+      futures = [executor.submit(_measure, left_image, right_image, matching_cost_name, matching_algorithm_name,
+                                 max_disparity, filter_radius, num_threads, Backend.NUMBA, number_of_repetitions, barrier)
+                 for _ in range(number_of_jobs)]
+      run_times = [f.result() for f in futures]
+  return sum(1/t for t in run_times)
+
+
+if __name__== "__main__":
+  # Parse input arguments
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-l", "--left", type=str,
+                      help="Path to left image")
+  parser.add_argument("-r", "--right", type=str,
+                      help="Path to right image")
+  parser.add_argument("-a", "--algorithm", type=str, choices=MatchingAlgorithm.names(),
+                      help="Matching cost algorithm", default = "WTA")
+  parser.add_argument("-c", "--cost", type=str, choices=MatchingCost.names(),
+                      help="Matching cost type", default = "SAD")
+  parser.add_argument("-D", "--disparity", type=int,
+                      help="Maximum disparity", default = 60)
+  parser.add_argument("-R", "--radius", type=int,
+                      help="Filter radius", default = 3)
+  parser.add_argument("-t", "--threads", type=int,
+                      help="Maximum number of threads, by default all available threads", default = Parallel.max_threads())
+  parser.add_argument("-b", "--backend", type=str, choices=[b.value for b in Backend], nargs="+",
+                      help="Parallel backends to be benchmarked", default = [b.value for b in Backend])
+  parser.add_argument("-n", "--repetitions", type=int,
+                      help="Number of repetitions", default = 3)
+  parser.add_argument("-j", "--no-jobs", action='store_true',
+                      help="Flag for de-activating the benchmark of concurrent jobs")
+  parser.add_argument("-L", "--threading-layer", type=str, choices=Parallel.threading_layers,
+                      help="Numba threading layer, by default chosen by numba", default = None)
+  args = parser.parse_args()
+
+  if args.threading_layer is not None:
+    Parallel.set_threading_layer(args.threading_layer)
+  main(args.left, args.right, args.algorithm, args.cost, args.disparity, args.radius,
+       args.threads, args.backend, args.repetitions, not args.no_jobs)
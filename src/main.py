@@ -8,24 +8,21 @@ import argparse
 import matplotlib.pyplot as plt
 import numpy as np
 
-from matching_algorithm.matching_algorithm import MatchingAlgorithm
-from matching_algorithm.semi_global_matching import SemiGlobalMatching
-from matching_algorithm.winner_takes_it_all import WinnerTakesItAll
-
-from matching_cost.matching_cost import MatchingCost
-from matching_cost.normalised_cross_correlation import NormalisedCrossCorrelation
-from matching_cost.sum_of_absolute_differences import SumOfAbsoluteDifferences
-from matching_cost.sum_of_squared_differences import SumOfSquaredDifferences
+from matching_algorithm import MatchingAlgorithm
+from matching_cost import MatchingCost
 
+from parallel import Backend, Parallel
 from stereo_matching import StereoMatching
-from utilities import AccX, IO
+from utilities import AccX, IO, PeakMemory
 
 
 def main(left_image_path: str, right_image_path: str, 
          matching_algorithm_name: str, matching_cost_name: str, 
          max_disparity: int, filter_radius: int, 
          groundtruth_image_path: str, mask_image_path: str, accx_threshold: int,
-         output_path: str = None, output_name: str = "unknown", is_plot: bool = True) -> None:
+         output_path: str = None, output_name: str = "unknown", is_plot: bool = True,
+         memory_budget: int = None, num_threads: int = None, backend_name: str = "numba",
+         threading_layer: str = None) -> None:
   # Imports images for stereo matching, performs stereo matching, plots results and outputs them to a file
   #   @param[in] left_image_path:          Path to the image for the left eye
   #   @param[in] right_image_path:         Path to the image for the right eye
@@ -39,6 +36,10 @@ def main(left_image_path: str, right_image_path: str,
   #   @param[in] output_path:              Location of the output path, if None no output is generated
   #   @param[in] output_name:              Name of the scenario for pre-pending the output file
   #   @param[in] is_plot:                  Flag for turning plot of results on and off
+  #   @param[in] memory_budget:            Maximum memory in bytes to be allocated for stereo matching, if None unlimited
+  #   @param[in] num_threads:              Number of threads or processes, if None all available threads
+  #   @param[in] backend_name:             Name of the parallel backend
+  #   @param[in] threading_layer:          Name of the numba threading layer, if None chosen by numba
   
   # Load input images
   left_image = IO.import_image(left_image_path)
@@ -60,30 +61,23 @@ def main(left_image_path: str, right_image_path: str,
     plt.subplot(1,2,2), plt.imshow(right_image, cmap='gray'), plt.title('Right')
     plt.tight_layout()
 
+  # Set-up parallelisation
+  backend = Backend(backend_name)
+  if threading_layer is not None:
+    Parallel.set_threading_layer(threading_layer)
+
   # Set-up algorithm
-  matching_algorithm = None
-  if matching_algorithm_name == "SGM":
-    matching_algorithm = SemiGlobalMatching
-  elif matching_algorithm_name == "WTA":
-    matching_algorithm = WinnerTakesItAll
-  else:
-    raise ValueError("Matching algorithm '" + matching_algorithm_name + "' not recognised!")
-  
-  matching_cost = None
-  if matching_cost_name == "NCC":
-    matching_cost = NormalisedCrossCorrelation
-  elif matching_cost_name == "SAD":
-    matching_cost = SumOfAbsoluteDifferences
-  elif matching_cost_name == "SSD":
-    matching_cost = SumOfSquaredDifferences
-  else:
-    raise ValueError("Matching cost '" + matching_cost_name + "' not recognised!")
+  matching_algorithm = MatchingAlgorithm.from_name(matching_algorithm_name)
+  matching_cost = MatchingCost.from_name(matching_cost_name)
 
   # Perform stereo matching
-  sm = StereoMatching(left_image, right_image, matching_cost, matching_algorithm, max_disparity, filter_radius)
+  sm = StereoMatching(left_image, right_image, matching_cost, matching_algorithm, max_disparity, filter_radius, 
+                      memory_budget, num_threads, backend, measure_memory = True)
   print("Performing stereo matching...")
   sm.compute()
+  sm.close()
   print("Stereo matching completed.")
+  print("Peak memory estimated: " + PeakMemory.str_megabytes(sm.estimated_memory()) + ", measured: " + PeakMemory.str_megabytes(sm.peak_memory()))
   res_image = sm.result()
 
   # Compute accuracy
@@ -115,9 +109,9 @@ if __name__== "__main__":
                       help="Path to left image")
   parser.add_argument("-r", "--right", type=str, 
                       help="Path to right image")
-  parser.add_argument("-a", "--algorithm", type=str, choices=["SGM", "WTA"],
+  parser.add_argument("-a", "--algorithm", type=str, choices=MatchingAlgorithm.names(),
                       help="Matching cost algorithm", default = "WTA")
-  parser.add_argument("-c", "--cost", type=str, choices=["NCC", "SAD", "SSD"],
+  parser.add_argument("-c", "--cost", type=str, choices=MatchingCost.names(),
                       help="Matching cost type", default = "SAD")
   parser.add_argument("-D", "--disparity", type=int, 
                       help="Maximum disparity", default = 60)
@@ -135,8 +129,21 @@ if __name__== "__main__":
                       help="Path to mask image for AccX accuracy measure", default = None)
   parser.add_argument("-X", "--accx", type=int, 
                       help="AccX accuracy measure threshold", default = 60)
+  parser.add_argument("-M", "--memory-budget", type=float, 
+                      help="Memory budget in megabytes, by default unlimited", default = None)
+  parser.add_argument("-t", "--threads", type=int, 
+                      help="Number of threads or processes, by default all available threads", default = None)
+  parser.add_argument("-b", "--backend", type=str, choices=[b.value for b in Backend],
+                      help="Parallel backend", default = "numba")
+  parser.add_argument("-L", "--threading-layer", type=str, choices=Parallel.threading_layers,
+                      help="Numba threading layer, by default chosen by numba", default = None)
   args = parser.parse_args()
 
+  memory_budget = None
+  if args.memory_budget is not None:
+    memory_budget = int(args.memory_budget*1024**2)
+
   main(args.left, args.right, args.algorithm, args.cost, args.disparity, args.radius, 
        args.groundtruth, args.mask, args.accx, 
-       args.output, args.name, not args.no_plot)
+       args.output, args.name, not args.no_plot, memory_budget, 
+       args.threads, args.backend, args.threading_layer)
@@ -0,0 +1,3 @@
+from .matching_algorithm import MatchingAlgorithm
+from .semi_global_matching import SemiGlobalMatching
+from .winner_takes_it_all import WinnerTakesItAll
@@ -5,10 +5,53 @@
 
 import abc
 import numpy as np
+from typing import Callable, Dict, List, Tuple, Type
 
 
 class MatchingAlgorithm(abc.ABC):
   # Base class for stereo matching algorithms which finds the best matching pixel
+  # Every derived class that sets its own name is registered automatically and declares its capabilities:
+  #   name:             Short name of the matching algorithm used for selecting it (e.g. on the command line)
+  #   supported_dtypes: Floating point types of the cost volume the matching algorithm can process
+  #   volume_layout:    Memory layout of the cost volume the matching algorithm accesses most efficiently ("HWD" or "DHW")
+  #   is_streamable:    Horizontal strips of the cost volume can be matched independently of each other
+  #   is_fusable:       The matching algorithm is a pure winner-takes-it-all search and can be fused into the matching cost
+
+  name: str = None
+  supported_dtypes: Tuple[type, ...] = (np.float64,)
+  volume_layout: str = "HWD"
+  is_streamable: bool = False
+  is_fusable: bool = False
+
+  _registry: Dict[str, Type["MatchingAlgorithm"]] = {}
+
+  def __init_subclass__(cls, **kwargs) -> None:
+    # Register every derived matching algorithm that declares a name
+    #   @param[in] kwargs: Keyword arguments forwarded to the parent class
+
+    super().__init_subclass__(**kwargs)
+    if cls.__dict__.get("name") is not None:
+      if cls.name in MatchingAlgorithm._registry:
+        raise ValueError("Matching algorithm '" + cls.name + "' is already registered!")
+      MatchingAlgorithm._registry[cls.name] = cls
+    return
+
+  @staticmethod
+  def names() -> List[str]:
+    # Get the names of all registered matching algorithms
+    #   @return: The names of all registered matching algorithms in order of registration
+
+    return list(MatchingAlgorithm._registry.keys())
+
+  @staticmethod
+  def from_name(name: str) -> Type["MatchingAlgorithm"]:
+    # Look up a registered matching algorithm by its name
+    #   @param[in] name: The name of the matching algorithm (e.g. WTA, SGM)
+    #   @return: The class implementing the matching algorithm
+
+    if name not in MatchingAlgorithm._registry:
+      raise ValueError("Matching algorithm '" + str(name) + "' not recognised!")
+    return MatchingAlgorithm._registry[name]
 
   @staticmethod
   @abc.abstractmethod
@@ -18,4 +61,34 @@ class MatchingAlgorithm(abc.ABC):
     #   @return: The two-dimensional disparity image resulting from the best matching pixel inside the cost volume (H,W)
     if cost_volume.ndim == 3:
       raise ValueError("Cost volume (" + cost_volume.shape + ") must be three-dimensional!")
-    pass
\ No newline at end of file
+    pass
+
+  @classmethod
+  def match_batch(cls, cost_volumes: np.ndarray, disparity_images: np.ndarray, get_buffer: Callable) -> None:
+    # Function for matching the cost volumes of a stack of image pairs, by default one pair after another
+    #   @param[in] cost_volumes: The cost volumes to be searched for the best matching pixel (N,H,W,D)
+    #   @param[out] disparity_images: The pre-allocated disparity images to be overwritten (N,H,W)
+    #   @param[in] get_buffer: Function returning a scratch buffer that is reused between calls for a given name, shape and data type
+
+    for n in range(cost_volumes.shape[0]):
+      disparity_images[n] = cls.match(cost_volumes[n])
+    return
+
+  @staticmethod
+  def aggregate(cost_volume: np.ndarray) -> np.ndarray:
+    # Function for aggregating the cost volume into the costs match chooses the disparity with the lowest cost from,
+    # by default the cost volume itself
+    #   @param[in] cost_volume: The three-dimensional cost volume to be aggregated (H,W,D)
+    #   @return: The aggregated costs (H,W,D)
+
+    return cost_volume
+
+  @staticmethod
+  def estimate_memory(volume_shape: Tuple[int, int, int], dtype: type) -> int:
+    # Estimate the memory allocated by match in addition to the cost volume, by default only the disparity image
+    #   @param[in] volume_shape: The shape of the cost volume to be searched (H,W,D)
+    #   @param[in] dtype: The floating point type of the cost volume
+    #   @return: The estimated memory in bytes
+
+    (H,W,_) = volume_shape
+    return H*W*np.dtype(np.int64).itemsize
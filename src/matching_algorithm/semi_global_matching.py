@@ -4,14 +4,55 @@
 # @brief Semi-global matching (SGM) stereo matching algorithm
 
 import abc
-from numba import jit
+from numba import jit, prange
 import numpy as np
 from scipy.sparse import diags
+from typing import Callable, Tuple
 
 from .matching_algorithm import MatchingAlgorithm
 
 
+@jit(nopython = True, nogil = True, cache = True)
+def _compute_directional_message(cost_volume: np.ndarray, f: np.ndarray, message: np.ndarray, 
+                                 is_horizontal: bool, is_forward: bool) -> None:
+  # Compute the messages in one of the four directions for semi-global matching without flipping or transposing the cost volume
+  #   @param[in] cost_volume: Cost volume of shape (H,W,D)
+  #   @param[in] f: Pairwise costs of shape (D,D)
+  #   @param[out] message: Pre-allocated messages to be overwritten (H,W,D)
+  #   @param[in] is_horizontal: Flag for passing messages along W instead of H
+  #   @param[in] is_forward: Flag for passing messages in positive instead of negative direction
+
+  (H,W,D) = cost_volume.shape
+  (P,L) = (H,W) if is_horizontal else (W,H)
+  # Loop over passive direction
+  for i in range(0, P):
+    # Loop over forward direction
+    for j in range(0, L):
+      k = j if is_forward else L - 1 - j
+      (y,x) = (i,k) if is_horizontal else (k,i)
+      if j == 0:
+        for t in range(0, D):
+          message[y,x,t] = 0
+        continue
+
+      k_prev = k - 1 if is_forward else k + 1
+      (y_prev,x_prev) = (i,k_prev) if is_horizontal else (k_prev,i)
+      # Loop over all possible nodes
+      for t in range(0, D):
+        # Choose path of least effort over all possible connections
+        min_value = np.inf
+        for s in range(0, D):
+          # Input messages + unary cost + binary cost
+          value = message[y_prev,x_prev,s] + cost_volume[y_prev,x_prev,s] + f[t,s]
+          if value < min_value:
+            min_value = value
+        message[y,x,t] = min_value
+  return
+
+
 class SemiGlobalMatching(MatchingAlgorithm):
+  name = "SGM"
+  supported_dtypes = (np.float32, np.float64)
 
   @staticmethod
   def match(cost_volume: np.ndarray) -> np.ndarray:
@@ -23,6 +64,41 @@ class SemiGlobalMatching(MatchingAlgorithm):
     f = SemiGlobalMatching._get_f(max_disparity)
     return SemiGlobalMatching._compute_sgm(cost_volume, f)
 
+  @staticmethod
+  def aggregate(cost_volume: np.ndarray) -> np.ndarray:
+    # Function for aggregating the cost volume with the messages of all four directions
+    #   @param[in] cost_volume: The three-dimensional cost volume to be aggregated (H,W,D)
+    #   @return: The sum of the cost volume and the messages match chooses the disparity with the lowest cost from (H,W,D)
+
+    (_, _, max_disparity) = cost_volume.shape
+    f = SemiGlobalMatching._get_f(max_disparity)
+    return SemiGlobalMatching._aggregate(cost_volume, f)
+
+  @staticmethod
+  def estimate_memory(volume_shape: Tuple[int, int, int], dtype: type) -> int:
+    # Estimate the memory allocated by match in addition to the cost volume
+    #   @param[in] volume_shape: The shape of the cost volume to be searched (H,W,D)
+    #   @param[in] dtype: The floating point type of the cost volume
+    #   @return: The estimated memory in bytes
+
+    # Accumulated messages and messages of a single direction as well as pairwise costs and disparity image
+    (H,W,D) = volume_shape
+    return 2*H*W*D*np.dtype(dtype).itemsize + D*D*np.dtype(np.float64).itemsize + H*W*np.dtype(np.float64).itemsize
+
+  @staticmethod
+  def match_batch(cost_volumes: np.ndarray, disparity_images: np.ndarray, get_buffer: Callable) -> None:
+    # Function for matching the cost volumes of a stack of image pairs in a single parallel kernel
+    #   @param[in] cost_volumes: The cost volumes to be searched for the best matching pixel (N,H,W,D)
+    #   @param[out] disparity_images: The pre-allocated disparity images to be overwritten (N,H,W)
+    #   @param[in] get_buffer: Function returning a scratch buffer that is reused between calls for a given name, shape and data type
+
+    (_, _, _, max_disparity) = cost_volumes.shape
+    f = SemiGlobalMatching._get_f(max_disparity)
+    messages = get_buffer("sgm_messages", cost_volumes.shape, cost_volumes.dtype)
+    message = get_buffer("sgm_message", cost_volumes.shape, cost_volumes.dtype)
+    SemiGlobalMatching._compute_sgm_batch(cost_volumes, f, messages, message, disparity_images)
+    return
+
   def _get_f(D: int, L1: float = 0.025, L2: float = 0.5) -> np.ndarray:
     # Get pairwise cost matrix for semi-global matching
     #   @param[in] D: Maximum disparity, number of possible choices
@@ -44,7 +120,7 @@ class SemiGlobalMatching(MatchingAlgorithm):
     #   @return: Messages for all H in positive direction of W with possible options D (H,W,D)
     
     (H,W,D) = cost_volume.shape
-    mes = np.zeros((H,W,D))
+    mes = np.zeros((H,W,D), cost_volume.dtype)
     # Loop over passive direction
     for y in range(0, H):
       # Loop over forward direction
@@ -64,37 +140,91 @@ class SemiGlobalMatching(MatchingAlgorithm):
     return mes
 
   @staticmethod
-  def _compute_sgm(cost_volume: np.ndarray, f: np.ndarray) -> np.ndarray:
-    # Compute semi-global matching by message passing in four directions
+  def _aggregate(cost_volume: np.ndarray, f: np.ndarray) -> np.ndarray:
+    # Aggregate the cost volume with the messages passed in four directions
     #   @param[in] cost_volume: Cost volume of shape (H,W,D)
-    #   @param[in] f: Pairwise costs of shape (H,W,D,D)
-    #   @return: Pixel-wise disparity map of shape (H,W)
-    
+    #   @param[in] f: Pairwise costs of shape (D,D)
+    #   @return: Sum of unary costs and messages of shape (H,W,D)
+
     # Messages for every single spatial direction and collect in single message
     (H,W,D) = cost_volume.shape
-    mes = np.zeros((H,W,D))
+    mes = np.zeros((H,W,D), cost_volume.dtype)
     
+    # Messages of a single direction are accumulated directly so that only one of them is kept in memory at a time
     # Positive W
     mes += SemiGlobalMatching._compute_message(cost_volume, f)
     
     # Negative W
-    mes_buffer = np.zeros((H,W))
-    mes_buffer = SemiGlobalMatching._compute_message(np.flip(cost_volume, axis=1), f)
-    mes += np.flip(mes_buffer, axis=1)
+    mes += np.flip(SemiGlobalMatching._compute_message(np.flip(cost_volume, axis=1), f), axis=1)
     
     # Positive H
-    mes_buffer = SemiGlobalMatching._compute_message(np.transpose(cost_volume, (1, 0, 2)), f)
-    mes += np.transpose(mes_buffer, (1, 0, 2))
+    mes += np.transpose(SemiGlobalMatching._compute_message(np.transpose(cost_volume, (1, 0, 2)), f), (1, 0, 2))
     
     # Negative H
-    mes_buffer = SemiGlobalMatching._compute_message(np.flip(np.transpose(cost_volume, (1, 0, 2)), axis=1), f)
-    mes += np.transpose(np.flip(mes_buffer, axis=1), (1, 0, 2))
+    mes += np.transpose(np.flip(SemiGlobalMatching._compute_message(np.flip(np.transpose(cost_volume, (1, 0, 2)), axis=1), f), axis=1), (1, 0, 2))
+
+    # Unary cost and messages
+    mes += cost_volume
+    return mes
+
+  @staticmethod
+  def _compute_sgm(cost_volume: np.ndarray, f: np.ndarray) -> np.ndarray:
+    # Compute semi-global matching by message passing in four directions
+    #   @param[in] cost_volume: Cost volume of shape (H,W,D)
+    #   @param[in] f: Pairwise costs of shape (H,W,D,D)
+    #   @return: Pixel-wise disparity map of shape (H,W)
+    
+    (H,W,D) = cost_volume.shape
+    aggregated_costs = SemiGlobalMatching._aggregate(cost_volume, f)
     
     # Choose best believe from all messages
     disp_map = np.zeros((H,W))
     for y in range(0, H):
       for x in range(0, W):
         # Minimum argument of unary cost and messages
-        disp_map[y,x] = np.argmin(cost_volume[y,x,:] + mes[y,x,:])
+        disp_map[y,x] = np.argmin(aggregated_costs[y,x,:])
     
     return disp_map
+
+  @staticmethod
+  @jit(nopython = True, parallel = True, nogil = True, cache = True)
+  def _compute_sgm_batch(cost_volumes: np.ndarray, f: np.ndarray, messages: np.ndarray, message: np.ndarray, 
+                         disparity_images: np.ndarray) -> None:
+    # Compute semi-global matching of a stack of cost volumes by message passing in four directions
+    #   @param[in] cost_volumes: Cost volumes of shape (N,H,W,D)
+    #   @param[in] f: Pairwise costs of shape (D,D)
+    #   @param[out] messages: Scratch buffer for the accumulated messages (N,H,W,D)
+    #   @param[out] message: Scratch buffer for the messages of a single direction (N,H,W,D)
+    #   @param[out] disparity_images: The pre-allocated pixel-wise disparity maps to be overwritten (N,H,W)
+
+    (N,H,W,D) = cost_volumes.shape
+    # Loop over all cost volumes
+    for n in prange(N):
+      cost_volume = cost_volumes[n]
+      mes = messages[n]
+      mes_buffer = message[n]
+      for y in range(0, H):
+        for x in range(0, W):
+          for d in range(0, D):
+            mes[y,x,d] = 0
+
+      # Messages for every single spatial direction in the same order as _compute_sgm: positive W, negative W, positive H, negative H
+      for direction in range(0, 4):
+        _compute_directional_message(cost_volume, f, mes_buffer, direction < 2, direction % 2 == 0)
+        for y in range(0, H):
+          for x in range(0, W):
+            for d in range(0, D):
+              mes[y,x,d] += mes_buffer[y,x,d]
+
+      # Choose best believe from all messages
+      for y in range(0, H):
+        for x in range(0, W):
+          min_value = np.inf
+          disparity_images[n,y,x] = 0
+          for d in range(0, D):
+            # Minimum argument of unary cost and messages
+            value = cost_volume[y,x,d] + mes[y,x,d]
+            if value < min_value:
+              min_value = value
+              disparity_images[n,y,x] = d
+    return
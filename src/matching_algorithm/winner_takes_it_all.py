@@ -5,11 +5,16 @@
 
 import abc
 import numpy as np
+from typing import Callable
 
 from .matching_algorithm import MatchingAlgorithm
 
 
 class WinnerTakesItAll(MatchingAlgorithm):
+  name = "WTA"
+  supported_dtypes = (np.float32, np.float64)
+  is_streamable = True
+  is_fusable = True
 
   @staticmethod
   def match(cost_volume: np.ndarray) -> np.ndarray:
@@ -17,4 +22,14 @@ class WinnerTakesItAll(MatchingAlgorithm):
     #   @param[in] cost_volume: The three-dimensional cost volume to be searched for the best matching pixel (H,W,D)
     #   @return: The two-dimensional disparity image resulting from the best matching pixel inside the cost volume (H,W)
     
-    return np.argmin(cost_volume, axis=2)
\ No newline at end of file
+    return np.argmin(cost_volume, axis=2)
+
+  @staticmethod
+  def match_batch(cost_volumes: np.ndarray, disparity_images: np.ndarray, get_buffer: Callable) -> None:
+    # Function for matching the cost volumes of a stack of image pairs
+    #   @param[in] cost_volumes: The cost volumes to be searched for the best matching pixel (N,H,W,D)
+    #   @param[out] disparity_images: The pre-allocated disparity images to be overwritten (N,H,W)
+    #   @param[in] get_buffer: Function returning a scratch buffer that is reused between calls, not needed
+
+    np.argmin(cost_volumes, axis=3, out=disparity_images)
+    return
@@ -0,0 +1,4 @@
+from .matching_cost import MatchingCost
+from .normalised_cross_correlation import NormalisedCrossCorrelation
+from .sum_of_absolute_differences import SumOfAbsoluteDifferences
+from .sum_of_squared_differences import SumOfSquaredDifferences
@@ -5,10 +5,60 @@
 
 import abc
 import numpy as np
+from typing import Dict, List, Tuple, Type
 
 
 class MatchingCost(abc.ABC):
   # Base class for stereo matching costs for calculating a cost volume
+  # Every derived class that sets its own name is registered automatically and declares its capabilities:
+  #   name:             Short name of the matching cost used for selecting it (e.g. on the command line)
+  #   supported_dtypes: Floating point types of the input images the matching cost can be computed in
+  #   volume_layout:    Memory layout the cost volume is assembled in internally ("HWD" or "DHW"), the planner converts it
+  #                     into the layout of the matching algorithm
+  #   is_streamable:    The cost volume can be computed in independent horizontal strips
+  #   is_fusable:       Implements compute_wta for fusing the cost computation with a winner-takes-it-all search, has to agree with
+  #                     compute_wta being overridden
+
+  name: str = None
+  supported_dtypes: Tuple[type, ...] = (np.float64,)
+  volume_layout: str = "HWD"
+  is_streamable: bool = False
+  is_fusable: bool = False
+
+  _registry: Dict[str, Type["MatchingCost"]] = {}
+
+  def __init_subclass__(cls, **kwargs) -> None:
+    # Register every derived matching cost that declares a name
+    #   @param[in] kwargs: Keyword arguments forwarded to the parent class
+
+    super().__init_subclass__(**kwargs)
+    # The planner relies on is_fusable, it must not send requests to the stub of compute_wta
+    is_compute_wta = cls.compute_wta is not MatchingCost.compute_wta
+    if cls.is_fusable != is_compute_wta:
+      raise ValueError("Matching cost '" + cls.__name__ + "' declares is_fusable = " + str(cls.is_fusable) +
+                       " but " + ("does not implement" if cls.is_fusable else "implements") + " compute_wta!")
+    if cls.__dict__.get("name") is not None:
+      if cls.name in MatchingCost._registry:
+        raise ValueError("Matching cost '" + cls.name + "' is already registered!")
+      MatchingCost._registry[cls.name] = cls
+    return
+
+  @staticmethod
+  def names() -> List[str]:
+    # Get the names of all registered matching costs
+    #   @return: The names of all registered matching costs in order of registration
+
+    return list(MatchingCost._registry.keys())
+
+  @staticmethod
+  def from_name(name: str) -> Type["MatchingCost"]:
+    # Look up a registered matching cost by its name
+    #   @param[in] name: The name of the matching cost (e.g. SAD, SSD, NCC)
+    #   @return: The class implementing the matching cost
+
+    if name not in MatchingCost._registry:
+      raise ValueError("Matching cost '" + str(name) + "' not recognised!")
+    return MatchingCost._registry[name]
 
   @staticmethod
   @abc.abstractmethod
@@ -21,3 +71,66 @@ class MatchingCost(abc.ABC):
     #   @return: The best matching pixel inside the cost volume according to the pre-defined criterion (H,W,D)
 
     pass
+
+  @staticmethod
+  def compute_wta(left_image: np.ndarray, right_image: np.ndarray, max_disparity: int, filter_radius: int) -> np.ndarray:
+    # Function for calculating the disparity image with the minimum cost directly without storing the cost volume
+    # Only available for matching costs that declare is_fusable
+    #   @param[in] left_image: The left image to be used for stereo matching (H,W)
+    #   @param[in] right_image: The right image to be used for stereo matching (H,W)
+    #   @param[in] max_disparity: The maximum disparity to consider
+    #   @param[in] filter_radius: The filter radius to be considered for matching
+    #   @return: The disparity with the lowest cost for each pixel (H,W)
+
+    raise NotImplementedError("Matching cost can't be fused with a winner-takes-it-all search!")
+
+  @classmethod
+  def compute_batch(cls, left_images: np.ndarray, right_images: np.ndarray, max_disparity: int, filter_radius: int,
+                    cost_volumes: np.ndarray) -> None:
+    # Function for calculating the cost volumes of a stack of image pairs, by default one pair after another
+    #   @param[in] left_images: The left images to be used for stereo matching (N,H,W)
+    #   @param[in] right_images: The right images to be used for stereo matching (N,H,W)
+    #   @param[in] max_disparity: The maximum disparity to consider
+    #   @param[in] filter_radius: The filter radius to be considered for matching
+    #   @param[out] cost_volumes: The pre-allocated cost volumes to be overwritten (N,H,W,D)
+
+    for n in range(left_images.shape[0]):
+      cost_volumes[n] = cls.compute(left_images[n], right_images[n], max_disparity, filter_radius)
+    return
+
+  @classmethod
+  def compute_wta_batch(cls, left_images: np.ndarray, right_images: np.ndarray, max_disparity: int, filter_radius: int,
+                        disparity_images: np.ndarray) -> None:
+    # Function for calculating the disparities with the lowest cost of a stack of image pairs, by default one pair after another
+    # Only available for matching costs that declare is_fusable
+    #   @param[in] left_images: The left images to be used for stereo matching (N,H,W)
+    #   @param[in] right_images: The right images to be used for stereo matching (N,H,W)
+    #   @param[in] max_disparity: The maximum disparity to consider
+    #   @param[in] filter_radius: The filter radius to be considered for matching
+    #   @param[out] disparity_images: The pre-allocated disparity images to be overwritten (N,H,W)
+
+    for n in range(left_images.shape[0]):
+      disparity_images[n] = cls.compute_wta(left_images[n], right_images[n], max_disparity, filter_radius)
+    return
+
+  @staticmethod
+  def estimate_memory(image_shape: Tuple[int, int], max_disparity: int, dtype: type) -> int:
+    # Estimate the memory allocated by compute, dominated by the cost volume
+    #   @param[in] image_shape: The shape of the images to be used for stereo matching (H,W)
+    #   @param[in] max_disparity: The maximum disparity to consider
+    #   @param[in] dtype: The floating point type the cost volume is computed in
+    #   @return: The estimated memory in bytes
+
+    (H,W) = image_shape
+    return H*W*max_disparity*np.dtype(dtype).itemsize
+
+  @staticmethod
+  def estimate_fused_memory(image_shape: Tuple[int, int], max_disparity: int, dtype: type) -> int:
+    # Estimate the memory allocated by compute_wta, dominated by the disparity image
+    #   @param[in] image_shape: The shape of the images to be used for stereo matching (H,W)
+    #   @param[in] max_disparity: The maximum disparity to consider
+    #   @param[in] dtype: The floating point type the matching cost is computed in
+    #   @return: The estimated memory in bytes
+
+    (H,W) = image_shape
+    return H*W*np.dtype(np.int64).itemsize
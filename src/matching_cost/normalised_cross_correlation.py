@@ -3,16 +3,68 @@
 # @file normalised_cross_correlation.py
 # @brief Normalised cross correlation (NCC) stereo matching cost
 
-from numba import jit
+from numba import jit, prange
 import numpy as np
 
 from .matching_cost import MatchingCost
 
 
+@jit(nopython = True, nogil = True, cache = True)
+def _window_cost(left_image: np.ndarray, right_image: np.ndarray, y: int, x: int, d: int, filter_radius: int) -> float:
+  # Compute the Normalized Cross Correlation (NCC) between the window around a pixel of the left image and the shifted window of the right image
+  #   @param[in] left_image: The left image to be used for stereo matching (H,W)
+  #   @param[in] right_image: The right image to be used for stereo matching (H,W)
+  #   @param[in] y: The row of the pixel
+  #   @param[in] x: The column of the pixel
+  #   @param[in] d: The disparity to consider
+  #   @param[in] filter_radius: The filter radius to be considered for matching
+  #   @return: The matching cost of the pixel for the given disparity
+
+  l_mean = 0.0
+  r_mean = 0.0
+  n = 0
+
+  # Loop over window
+  for v in range(-filter_radius, filter_radius + 1):
+    for u in range(-filter_radius, filter_radius + 1):
+      # Calculate cumulative sum
+      l_mean += left_image[y+v, x+u]
+      r_mean += right_image[y+v, x+u-d]
+      n  += 1
+
+  l_mean = l_mean/n
+  r_mean = r_mean/n
+
+  l_r = 0.0
+  l_var = 0.0
+  r_var = 0.0
+
+  for v in range(-filter_radius, filter_radius + 1):
+    for u in range(-filter_radius, filter_radius + 1):
+      # Calculate terms
+      l = left_image[y+v, x+u]    - l_mean
+      r = right_image[y+v, x+u-d] - r_mean
+
+      l_r   += l*r
+      l_var += l**2
+      r_var += r**2
+
+  # Assemble terms, the correlation of a window without variance is undefined and treated as uncorrelated
+  var = l_var*r_var
+  if var == 0:
+    return 0.0
+  return -l_r/np.sqrt(var)
+
+
 class NormalisedCrossCorrelation(MatchingCost):
+  name = "NCC"
+  volume_layout = "DHW"
+  supported_dtypes = (np.float32, np.float64)
+  is_streamable = True
+  is_fusable = True
 
   @staticmethod
-  @jit(nopython = True, parallel = True, cache = True)
+  @jit(nopython = True, parallel = True, nogil = True, cache = True)
   def compute(left_image: np.ndarray, right_image: np.ndarray, max_disparity: int, filter_radius: int) -> np.ndarray:
     # Compute a cost volume with maximum disparity D considering a neighbourhood R with Normalized Cross Correlation (NCC)
     #   @param[in] left_image: The left image to be used for stereo matching (H,W)
@@ -22,7 +74,7 @@ class NormalisedCrossCorrelation(MatchingCost):
     #   @return: The best matching pixel inside the cost volume according to the pre-defined criterion (H,W,D)
     
     (H,W) = left_image.shape
-    cost_volume = np.zeros((max_disparity,H,W))
+    cost_volume = np.zeros((max_disparity,H,W), left_image.dtype)
     
     # Loop over all possible disparities
     for d in range(0, max_disparity):
@@ -58,7 +110,96 @@ class NormalisedCrossCorrelation(MatchingCost):
               l_var += l**2
               r_var += r**2
           
-          # Assemble terms
-          cost_volume[d,y,x] = -l_r/np.sqrt(l_var*r_var)
+          # Assemble terms, the correlation of a window without variance is undefined and treated as uncorrelated
+          var = l_var*r_var
+          if var == 0:
+            cost_volume[d,y,x] = 0
+          else:
+            cost_volume[d,y,x] = -l_r/np.sqrt(var)
     
-    return np.transpose(cost_volume, (1, 2, 0))
\ No newline at end of file
+    return np.transpose(cost_volume, (1, 2, 0))
+
+  @staticmethod
+  @jit(nopython = True, parallel = True, nogil = True, cache = True)
+  def compute_wta(left_image: np.ndarray, right_image: np.ndarray, max_disparity: int, filter_radius: int) -> np.ndarray:
+    # Compute the disparity with the lowest Normalized Cross Correlation (NCC) cost without storing the cost volume
+    #   @param[in] left_image: The left image to be used for stereo matching (H,W)
+    #   @param[in] right_image: The right image to be used for stereo matching (H,W)
+    #   @param[in] max_disparity: The maximum disparity to consider
+    #   @param[in] filter_radius: The filter radius to be considered for matching
+    #   @return: The disparity with the lowest cost for each pixel (H,W)
+
+    (H,W) = left_image.shape
+    disparity_image = np.zeros((H,W), dtype=np.int64)
+
+    # Loop over internal image
+    for y in prange(filter_radius, H - filter_radius):
+      for x in range(filter_radius, W - filter_radius):
+        min_cost = np.inf
+        # Loop over all possible disparities
+        for d in range(0, max_disparity):
+          cost = _window_cost(left_image, right_image, y, x, d, filter_radius)
+          # Keep the first disparity with the lowest cost
+          if cost < min_cost:
+            min_cost = cost
+            disparity_image[y,x] = d
+
+    return disparity_image
+
+  @staticmethod
+  @jit(nopython = True, parallel = True, nogil = True, cache = True)
+  def compute_batch(left_images: np.ndarray, right_images: np.ndarray, max_disparity: int, filter_radius: int,
+                    cost_volumes: np.ndarray) -> None:
+    # Compute the cost volumes of a stack of image pairs with Normalized Cross Correlation (NCC) in a single parallel kernel
+    #   @param[in] left_images: The left images to be used for stereo matching (N,H,W)
+    #   @param[in] right_images: The right images to be used for stereo matching (N,H,W)
+    #   @param[in] max_disparity: The maximum disparity to consider
+    #   @param[in] filter_radius: The filter radius to be considered for matching
+    #   @param[out] cost_volumes: The pre-allocated cost volumes to be overwritten (N,H,W,D)
+
+    (N,H,W) = left_images.shape
+
+    # Loop over all rows of all images
+    for i in prange(N*H):
+      (n, y) = (i//H, i%H)
+      (left_image, right_image) = (left_images[n], right_images[n])
+      for x in range(0, W):
+        is_border = (y < filter_radius) or (y >= H - filter_radius) or (x < filter_radius) or (x >= W - filter_radius)
+        # Loop over all possible disparities
+        for d in range(0, max_disparity):
+          if is_border:
+            cost_volumes[n,y,x,d] = 0
+          else:
+            cost_volumes[n,y,x,d] = _window_cost(left_image, right_image, y, x, d, filter_radius)
+    return
+
+  @staticmethod
+  @jit(nopython = True, parallel = True, nogil = True, cache = True)
+  def compute_wta_batch(left_images: np.ndarray, right_images: np.ndarray, max_disparity: int, filter_radius: int,
+                        disparity_images: np.ndarray) -> None:
+    # Compute the disparities with the lowest Normalized Cross Correlation (NCC) cost of a stack of image pairs in a single parallel kernel
+    #   @param[in] left_images: The left images to be used for stereo matching (N,H,W)
+    #   @param[in] right_images: The right images to be used for stereo matching (N,H,W)
+    #   @param[in] max_disparity: The maximum disparity to consider
+    #   @param[in] filter_radius: The filter radius to be considered for matching
+    #   @param[out] disparity_images: The pre-allocated disparity images to be overwritten (N,H,W)
+
+    (N,H,W) = left_images.shape
+
+    # Loop over all rows of all images
+    for i in prange(N*H):
+      (n, y) = (i//H, i%H)
+      (left_image, right_image) = (left_images[n], right_images[n])
+      for x in range(0, W):
+        disparity_images[n,y,x] = 0
+        if (y < filter_radius) or (y >= H - filter_radius) or (x < filter_radius) or (x >= W - filter_radius):
+          continue
+        min_cost = np.inf
+        # Loop over all possible disparities
+        for d in range(0, max_disparity):
+          cost = _window_cost(left_image, right_image, y, x, d, filter_radius)
+          # Keep the first disparity with the lowest cost
+          if cost < min_cost:
+            min_cost = cost
+            disparity_images[n,y,x] = d
+    return
@@ -3,16 +3,41 @@
 # @file sum_of_squared_differences.py
 # @brief Sum of squared differences (SSD) stereo matching cost
 
-from numba import jit
+from numba import jit, prange
 import numpy as np
 
 from .matching_cost import MatchingCost
 
 
+@jit(nopython = True, nogil = True, cache = True)
+def _window_costs(left_image: np.ndarray, right_image: np.ndarray, y: int, x: int, filter_radius: int, costs: np.ndarray) -> None:
+  # Compute the Sum of Squared Differences (SSD) between the window around a pixel of the left image and the shifted windows of the right image
+  # for all disparities at once, the disparities are the innermost loop as in compute so that it is vectorised
+  #   @param[in] left_image: The left image to be used for stereo matching (H,W)
+  #   @param[in] right_image: The right image to be used for stereo matching (H,W)
+  #   @param[in] y: The row of the pixel
+  #   @param[in] x: The column of the pixel
+  #   @param[in] filter_radius: The filter radius to be considered for matching
+  #   @param[out] costs: The pre-allocated matching costs of the pixel to be overwritten (D)
+
+  costs[:] = 0
+  # Loop over window
+  for v in range(-filter_radius, filter_radius + 1):
+    for u in range(-filter_radius, filter_radius + 1):
+      # Loop over all possible disparities
+      for d in range(0, costs.shape[0]):
+        costs[d] += (left_image[y+v, x+u] - right_image[y+v, x+u-d])**2
+  return
+
+
 class SumOfSquaredDifferences(MatchingCost):
+  name = "SSD"
+  supported_dtypes = (np.float32, np.float64)
+  is_streamable = True
+  is_fusable = True
 
   @staticmethod
-  @jit(nopython = True, parallel = True, cache = True)
+  @jit(nopython = True, parallel = True, nogil = True, cache = True)
   def compute(left_image: np.ndarray, right_image: np.ndarray, max_disparity: int, filter_radius: int) -> np.ndarray:
     # Compute a cost volume with maximum disparity D considering a neighbourhood R with Sum of Squared Differences (SSD)
     #   @param[in] left_image: The left image to be used for stereo matching (H,W)
@@ -22,7 +47,7 @@ class SumOfSquaredDifferences(MatchingCost):
     #   @return: The best matching pixel inside the cost volume according to the pre-defined criterion (H,W,D)
     
     (H,W) = left_image.shape
-    cost_volume = np.zeros((H,W,max_disparity))
+    cost_volume = np.zeros((H,W,max_disparity), left_image.dtype)
     
     # Loop over internal image
     for y in range(filter_radius, H - filter_radius):
@@ -34,4 +59,78 @@ class SumOfSquaredDifferences(MatchingCost):
             for d in range(0, max_disparity):
               cost_volume[y,x,d] += (left_image[y+v, x+u] - right_image[y+v, x+u-d])**2
         
-    return cost_volume
\ No newline at end of file
+    return cost_volume
+
+  @staticmethod
+  @jit(nopython = True, parallel = True, nogil = True, cache = True)
+  def compute_wta(left_image: np.ndarray, right_image: np.ndarray, max_disparity: int, filter_radius: int) -> np.ndarray:
+    # Compute the disparity with the lowest Sum of Squared Differences (SSD) cost without storing the cost volume
+    #   @param[in] left_image: The left image to be used for stereo matching (H,W)
+    #   @param[in] right_image: The right image to be used for stereo matching (H,W)
+    #   @param[in] max_disparity: The maximum disparity to consider
+    #   @param[in] filter_radius: The filter radius to be considered for matching
+    #   @return: The disparity with the lowest cost for each pixel (H,W)
+
+    (H,W) = left_image.shape
+    disparity_image = np.zeros((H,W), dtype=np.int64)
+
+    # Loop over internal image
+    for y in prange(filter_radius, H - filter_radius):
+      costs = np.empty(max_disparity)
+      for x in range(filter_radius, W - filter_radius):
+        _window_costs(left_image, right_image, y, x, filter_radius, costs)
+        # Keep the first disparity with the lowest cost
+        disparity_image[y,x] = np.argmin(costs)
+
+    return disparity_image
+
+  @staticmethod
+  @jit(nopython = True, parallel = True, nogil = True, cache = True)
+  def compute_batch(left_images: np.ndarray, right_images: np.ndarray, max_disparity: int, filter_radius: int,
+                    cost_volumes: np.ndarray) -> None:
+    # Compute the cost volumes of a stack of image pairs with Sum of Squared Differences (SSD) in a single parallel kernel
+    #   @param[in] left_images: The left images to be used for stereo matching (N,H,W)
+    #   @param[in] right_images: The right images to be used for stereo matching (N,H,W)
+    #   @param[in] max_disparity: The maximum disparity to consider
+    #   @param[in] filter_radius: The filter radius to be considered for matching
+    #   @param[out] cost_volumes: The pre-allocated cost volumes to be overwritten (N,H,W,D)
+
+    (N,H,W) = left_images.shape
+
+    # Loop over all rows of all images
+    for i in prange(N*H):
+      (n, y) = (i//H, i%H)
+      (left_image, right_image) = (left_images[n], right_images[n])
+      for x in range(0, W):
+        if (y < filter_radius) or (y >= H - filter_radius) or (x < filter_radius) or (x >= W - filter_radius):
+          cost_volumes[n,y,x,:] = 0
+        else:
+          _window_costs(left_image, right_image, y, x, filter_radius, cost_volumes[n,y,x])
+    return
+
+  @staticmethod
+  @jit(nopython = True, parallel = True, nogil = True, cache = True)
+  def compute_wta_batch(left_images: np.ndarray, right_images: np.ndarray, max_disparity: int, filter_radius: int,
+                        disparity_images: np.ndarray) -> None:
+    # Compute the disparities with the lowest Sum of Squared Differences (SSD) cost of a stack of image pairs in a single parallel kernel
+    #   @param[in] left_images: The left images to be used for stereo matching (N,H,W)
+    #   @param[in] right_images: The right images to be used for stereo matching (N,H,W)
+    #   @param[in] max_disparity: The maximum disparity to consider
+    #   @param[in] filter_radius: The filter radius to be considered for matching
+    #   @param[out] disparity_images: The pre-allocated disparity images to be overwritten (N,H,W)
+
+    (N,H,W) = left_images.shape
+
+    # Loop over all rows of all images
+    for i in prange(N*H):
+      (n, y) = (i//H, i%H)
+      (left_image, right_image) = (left_images[n], right_images[n])
+      costs = np.empty(max_disparity)
+      for x in range(0, W):
+        disparity_images[n,y,x] = 0
+        if (y < filter_radius) or (y >= H - filter_radius) or (x < filter_radius) or (x >= W - filter_radius):
+          continue
+        _window_costs(left_image, right_image, y, x, filter_radius, costs)
+        # Keep the first disparity with the lowest cost
+        disparity_images[n,y,x] = np.argmin(costs)
+    return
@@ -0,0 +1,116 @@
+# Tobit Flatscher - github.com/2b-t (2022)
+
+# @file parallel.py
+# @brief Control of the number of threads and the parallel backend used for stereo matching
+
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from enum import Enum
+import multiprocessing
+import numba
+from typing import Callable, List
+
+
+class Backend(Enum):
+  # Parallel backends for stereo matching
+  NUMBA = "numba"         # Parallelise inside the kernels with the numba threading layer
+  THREADS = "threads"     # Distribute horizontal strips onto a pool of Python threads each running the kernels single-threaded
+  PROCESSES = "processes" # Distribute horizontal strips onto a pool of processes each running the kernels single-threaded
+
+
+class Parallel:
+  # Class for controlling the parallel execution of the numba kernels
+
+  threading_layers = ["default", "safe", "forksafe", "threadsafe", "tbb", "omp", "workqueue"]
+
+  @staticmethod
+  def max_threads() -> int:
+    # Get the maximum number of threads numba can use, limited by the environment variable NUMBA_NUM_THREADS
+    #   @return: The maximum number of threads
+
+    return numba.config.NUMBA_NUM_THREADS
+
+  @staticmethod
+  def threading_layer() -> str:
+    # Get the numba threading layer in use
+    #   @return: The name of the threading layer or None if no parallel kernel has been executed yet
+
+    try:
+      return numba.threading_layer()
+    except ValueError:
+      return None
+
+  @staticmethod
+  def set_threading_layer(name: str) -> None:
+    # Select the numba threading layer, only possible before the first parallel kernel is executed
+    #   @param[in] name: The name of the threading layer or of a group of threading layers (e.g. threadsafe)
+
+    if name not in Parallel.threading_layers:
+      raise ValueError("Threading layer '" + str(name) + "' not recognised!")
+    current_layer = Parallel.threading_layer()
+    if (current_layer is not None) and (current_layer != name):
+      raise ValueError("Threading layer can't be changed to '" + name + "' as '" + current_layer + "' is already in use.")
+    numba.config.THREADING_LAYER = name
+    return
+
+  @staticmethod
+  def check_backend(backend: Backend, num_threads: int) -> None:
+    # Check if the backend can be used with the given number of threads and prepare the threading layer for it
+    #   @param[in] backend: The parallel backend
+    #   @param[in] num_threads: The number of threads or processes
+
+    if num_threads <= 0:
+      raise ValueError("Number of threads (" + str(num_threads) + ") has to be greater than zero.")
+    if (backend == Backend.NUMBA) and (num_threads > Parallel.max_threads()):
+      raise ValueError("Number of threads (" + str(num_threads) + ") exceeds the maximum of " + str(Parallel.max_threads()) +
+                       " threads, increase it with the environment variable NUMBA_NUM_THREADS.")
+
+    # Parallel kernels called from several Python threads require a threadsafe threading layer
+    if backend == Backend.THREADS:
+      if (Parallel.threading_layer() is None) and (numba.config.THREADING_LAYER == "default"):
+        numba.config.THREADING_LAYER = "threadsafe"
+      elif Parallel.threading_layer() == "workqueue":
+        raise ValueError("Threading layer 'workqueue' can't be used with backend '" + backend.value + "' as it is not threadsafe.")
+    return
+
+  @staticmethod
+  def executor(backend: Backend, num_threads: int) -> Executor:
+    # Create the pool of threads or processes of a backend that can be reused between calls of map and has to be shut down by the caller
+    #   @param[in] backend: The parallel backend
+    #   @param[in] num_threads: The number of threads or processes of the pool
+    #   @return: The pool or None for the numba backend that does not require one
+
+    Parallel.check_backend(backend, num_threads)
+
+    # The number of threads is local to every thread and process of the pool
+    if backend == Backend.NUMBA:
+      return None
+    if backend == Backend.THREADS:
+      return ThreadPoolExecutor(num_threads, initializer=numba.set_num_threads, initargs=(1,))
+    # Forking a process that already runs a threading layer is unsafe
+    return ProcessPoolExecutor(num_threads, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=numba.set_num_threads, initargs=(1,))
+
+  @staticmethod
+  def map(function: Callable, arguments: List[tuple], backend: Backend, num_threads: int, executor: Executor = None) -> list:
+    # Call a function for each set of arguments with the given backend
+    #   @param[in] function: The function to be called, has to be picklable for the process backend
+    #   @param[in] arguments: The list of positional arguments for each call
+    #   @param[in] backend: The parallel backend
+    #   @param[in] num_threads: The number of threads used inside the kernels or the number of threads or processes of the pool
+    #   @param[in] executor: The pool created by Parallel.executor for the backend, None for starting and shutting down a pool for this call
+    #   @return: The results of all calls in order of the arguments
+
+    Parallel.check_backend(backend, num_threads)
+
+    if backend == Backend.NUMBA:
+      previous_num_threads = numba.get_num_threads()
+      numba.set_num_threads(num_threads)
+      try:
+        return [function(*a) for a in arguments]
+      finally:
+        numba.set_num_threads(previous_num_threads)
+
+    if executor is not None:
+      return list(executor.map(function, *zip(*arguments)))
+    with Parallel.executor(backend, num_threads) as executor:
+      return list(executor.map(function, *zip(*arguments)))
@@ -0,0 +1,514 @@
+#!/usr/bin/env python3
+# Tobit Flatscher - github.com/2b-t (2022)
+
+# @file service.py
+# @brief Long-lived local stereo matching service with warm kernels exchanging frames through shared memory
+
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import http.client
+import http.server
+import json
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+import os
+import socket
+import socketserver
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from batch_stereo_matching import BatchStereoMatching, BufferPool
+from matching_algorithm import MatchingAlgorithm
+from matching_cost import MatchingCost
+from parallel import Backend, Parallel
+from stereo_matching import StereoMatching
+
+
+class ServiceMetrics:
+  # Thread-safe counters of the requests of the service and their latencies over a sliding window
+
+  def __init__(self, window: int = 1000):
+    # Class constructor
+    #   @param[in] window: The number of most recent requests the latencies are computed from
+
+    self._lock = threading.Lock()
+    self._queue_depth = 0
+    self._running = 0
+    self._completed = 0
+    self._failed = 0
+    self._queue_times = deque(maxlen=window)
+    self._latencies = deque(maxlen=window)
+    return
+
+  def submit(self) -> None:
+    # Record a request that was put into the queue
+
+    with self._lock:
+      self._queue_depth += 1
+    return
+
+  def start(self, queue_time: float) -> None:
+    # Record a request that was taken from the queue by a worker
+    #   @param[in] queue_time: The time in seconds the request waited in the queue
+
+    with self._lock:
+      self._queue_depth -= 1
+      self._running += 1
+      self._queue_times.append(queue_time)
+    return
+
+  def finish(self, latency: float, is_success: bool) -> None:
+    # Record a request that was completed by a worker
+    #   @param[in] latency: The time in seconds from putting the request into the queue until its completion
+    #   @param[in] is_success: Flag whether the request succeeded or failed
+
+    with self._lock:
+      self._running -= 1
+      if is_success:
+        self._completed += 1
+      else:
+        self._failed += 1
+      self._latencies.append(latency)
+    return
+
+  def to_dict(self) -> dict:
+    # Get a snapshot of the metrics
+    #   @return: The metrics with times in milliseconds
+
+    with self._lock:
+      return {"queue_depth": self._queue_depth,
+              "running": self._running,
+              "completed": self._completed,
+              "failed": self._failed,
+              "queue_time_ms": ServiceMetrics._summarise(self._queue_times),
+              "latency_ms": ServiceMetrics._summarise(self._latencies)}
+
+  @staticmethod
+  def _summarise(times: deque) -> dict:
+    # Summarise a window of times
+    #   @param[in] times: The times in seconds
+    #   @return: The mean, median, 99th percentile and maximum in milliseconds, None if there are no times yet
+
+    if not times:
+      return {"mean": None, "p50": None, "p99": None, "max": None}
+    t = 1e3*np.asarray(times)
+    return {"mean": float(np.mean(t)), "p50": float(np.percentile(t, 50)),
+            "p99": float(np.percentile(t, 99)), "max": float(np.max(t))}
+
+
+class StereoService:
+  # Service that keeps the kernels of all registered matching costs and algorithms compiled and processes
+  # requests from other local processes on a pool of workers
+  # The images and disparity images are exchanged through shared memory owned by the client, only a small
+  # JSON description of the request is sent either line by line over a Unix socket or as the body of an HTTP POST:
+  #   {"command": "match", "cost": "SAD", "algorithm": "WTA", "max_disparity": 60, "filter_radius": 3,
+  #    "left":   {"name": <shared memory>, "shape": [H,W] or [N,H,W], "dtype": "float64"},
+  #    "right":  {"name": <shared memory>, "shape": [H,W] or [N,H,W], "dtype": "float64"},
+  #    "result": {"name": <shared memory>, "shape": [H,W] or [N,H,W], "dtype": "int64"}}
+  # The process id of the client ("pid") is optional and only needed for clients running inside the process of the service
+  # The commands "metrics" and "ping" return the metrics of the service and an empty response respectively
+
+  def __init__(self, num_workers: int = 1, num_threads: int = None, memory_budget: int = None):
+    # Class constructor
+    #   @param[in] num_workers: The number of requests processed at the same time
+    #   @param[in] num_threads: The number of threads of every worker, None for sharing all threads between the workers
+    #   @param[in] memory_budget: The maximum memory in bytes to be allocated by every request, for stacks of image pairs
+    #                             the number of cost volumes kept in memory at once is reduced accordingly, None for unlimited
+
+    if (num_workers <= 0):
+      raise ValueError("Number of workers (" + str(num_workers) + ") has to be greater than zero.")
+    if num_threads is None:
+      num_threads = max(Parallel.max_threads()//num_workers, 1)
+    Parallel.check_backend(Backend.NUMBA, num_threads)
+    # Several workers call the parallel kernels at the same time
+    Parallel.check_backend(Backend.THREADS, num_workers)
+
+    self._num_workers = num_workers
+    self._num_threads = num_threads
+    self._memory_budget = memory_budget
+    self._metrics = ServiceMetrics()
+    self._executor = ThreadPoolExecutor(num_workers, thread_name_prefix="stereo_worker")
+    self._local = threading.local()
+    self._servers = []
+    return
+
+  def warm_up(self) -> None:
+    # Compile the kernels of all combinations of registered matching costs and algorithms on small random images
+
+    rng = np.random.default_rng(0)
+    for matching_cost_name in MatchingCost.names():
+      for matching_algorithm_name in MatchingAlgorithm.names():
+        matching_cost = MatchingCost.from_name(matching_cost_name)
+        matching_algorithm = MatchingAlgorithm.from_name(matching_algorithm_name)
+        images = rng.random((2, 8, 8))
+        sm = StereoMatching(images[0], images[1], matching_cost, matching_algorithm, 2, 1, None, self._num_threads)
+        sm.compute()
+        bsm = BatchStereoMatching(matching_cost, matching_algorithm, 2, 1, self._num_threads)
+        bsm.compute(images, images)
+    return
+
+  def handle(self, request: dict) -> dict:
+    # Handle a request, blocking until it is processed
+    #   @param[in] request: The decoded request
+    #   @return: The response to be encoded, with the status "ok" or "error"
+
+    if not isinstance(request, dict):
+      return {"status": "error", "message": "Invalid request: expected a JSON object but got " + type(request).__name__ + "."}
+    command = request.get("command", "match")
+    if command == "ping":
+      return {"status": "ok"}
+    if command == "metrics":
+      return {"status": "ok", "metrics": self.metrics()}
+    if command != "match":
+      return {"status": "error", "message": "Command '" + str(command) + "' not recognised!"}
+
+    self._metrics.submit()
+    return self._executor.submit(self._process, request, time.perf_counter()).result()
+
+  def metrics(self) -> dict:
+    # Get a snapshot of the metrics of the service
+    #   @return: The queue depth, the number of running, completed and failed requests and their latencies
+
+    metrics = self._metrics.to_dict()
+    metrics["workers"] = self._num_workers
+    metrics["threads_per_worker"] = self._num_threads
+    return metrics
+
+  def serve_unix(self, socket_path: str) -> socketserver.BaseServer:
+    # Start listening on a Unix socket in a background thread
+    #   @param[in] socket_path: The path of the Unix socket, an existing socket file is replaced
+    #   @return: The server that can be shut down with shutdown
+
+    if os.path.exists(socket_path):
+      os.remove(socket_path)
+    server = socketserver.ThreadingUnixStreamServer(socket_path, _UnixRequestHandler)
+    return self._serve(server)
+
+  def serve_http(self, port: int, host: str = "127.0.0.1") -> socketserver.BaseServer:
+    # Start listening for HTTP requests in a background thread
+    #   @param[in] port: The port, 0 for choosing a free port
+    #   @param[in] host: The address to bind to, by default only local connections are accepted
+    #   @return: The server that can be shut down with shutdown
+
+    server = http.server.ThreadingHTTPServer((host, port), _HttpRequestHandler)
+    return self._serve(server)
+
+  def shutdown(self) -> None:
+    # Stop all servers and the pool of workers
+
+    for server in self._servers:
+      server.shutdown()
+      server.server_close()
+      if isinstance(server, socketserver.UnixStreamServer) and os.path.exists(server.server_address):
+        os.remove(server.server_address)
+    self._servers.clear()
+    self._executor.shutdown()
+    return
+
+  def _serve(self, server: socketserver.BaseServer) -> socketserver.BaseServer:
+    # Run a server in a background thread
+    #   @param[in] server: The server to be run
+    #   @return: The running server
+
+    server.daemon_threads = True
+    server.service = self
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    self._servers.append(server)
+    return server
+
+  def _process(self, request: dict, submit_time: float) -> dict:
+    # Process a request on a worker
+    #   @param[in] request: The decoded request
+    #   @param[in] submit_time: The time the request was put into the queue
+    #   @return: The response
+
+    start_time = time.perf_counter()
+    self._metrics.start(start_time - submit_time)
+    segments = []
+    try:
+      self._match(request, segments)
+      response = {"status": "ok"}
+    except Exception as e:
+      response = {"status": "error", "message": type(e).__name__ + ": " + str(e)}
+    finally:
+      for segment in segments:
+        segment.close()
+
+    end_time = time.perf_counter()
+    self._metrics.finish(end_time - submit_time, response["status"] == "ok")
+    response["compute_time"] = end_time - start_time
+    response["latency"] = end_time - submit_time
+    return response
+
+  def _match(self, request: dict, segments: List[shared_memory.SharedMemory]) -> None:
+    # Perform stereo matching on the images in shared memory and write the disparity images to shared memory
+    # The arrays only live inside this function so that the shared memory can be closed afterwards
+    #   @param[in] request: The decoded request
+    #   @param[out] segments: The shared memory that was attached and has to be closed
+
+    is_owner = (request.get("pid") == os.getpid())
+    left_images = _attach(request["left"], segments, is_owner)
+    right_images = _attach(request["right"], segments, is_owner)
+    result = _attach(request["result"], segments, is_owner)
+    if (result.shape != left_images.shape):
+      raise ValueError("Dimensions of result " + str(result.shape) + " and images " + str(left_images.shape) + " do not match.")
+
+    matching_cost = MatchingCost.from_name(request["cost"])
+    matching_algorithm = MatchingAlgorithm.from_name(request["algorithm"])
+    max_disparity = int(request.get("max_disparity", 60))
+    filter_radius = int(request.get("filter_radius", 3))
+
+    if left_images.ndim == 3:
+      result[...] = self._get_batch_stereo_matching(matching_cost, matching_algorithm, max_disparity, filter_radius).compute(left_images, right_images)
+    else:
+      # The peak memory is not measured as this would reset it for the whole process including the other workers
+      sm = StereoMatching(left_images, right_images, matching_cost, matching_algorithm, max_disparity, filter_radius,
+                          self._memory_budget, self._num_threads, measure_memory = False)
+      sm.compute()
+      result[...] = sm.result()
+    return
+
+  def _get_batch_stereo_matching(self, matching_cost: MatchingCost, matching_algorithm: MatchingAlgorithm,
+                                 max_disparity: int, filter_radius: int) -> BatchStereoMatching:
+    # Get a batch stereo matching sharing the scratch buffers of the current worker so that they are reused between requests
+    # A buffer is replaced when its shape changes, every worker therefore only keeps the scratch buffers of a single request
+    #   @param[in] matching_cost: The class implementing the matching cost
+    #   @param[in] matching_algorithm: The class implementing the matching algorithm
+    #   @param[in] max_disparity: The maximum disparity to consider
+    #   @param[in] filter_radius: The radius of the filter
+    #   @return: The batch stereo matching
+
+    if not hasattr(self._local, "buffer_pool"):
+      self._local.buffer_pool = BufferPool()
+    return BatchStereoMatching(matching_cost, matching_algorithm, max_disparity, filter_radius,
+                               self._num_threads, None, self._memory_budget, self._local.buffer_pool)
+
+
+class StereoClient:
+  # Client of a stereo matching service running on the same machine
+  # The shared memory for the images and disparity images is created by the client and reused between requests
+
+  def __init__(self, socket_path: str = None, port: int = None, host: str = "127.0.0.1"):
+    # Class constructor
+    #   @param[in] socket_path: The path of the Unix socket of the service
+    #   @param[in] port: The port of the HTTP server of the service if no Unix socket is given
+    #   @param[in] host: The address of the HTTP server of the service
+
+    if (socket_path is None) == (port is None):
+      raise ValueError("Either a Unix socket or a port has to be given.")
+
+    self._socket_path = socket_path
+    self._port = port
+    self._host = host
+    self._connection = None
+    self._file = None
+    self._segments: Dict[str, shared_memory.SharedMemory] = {}
+    return
+
+  def match(self, left_images: np.ndarray, right_images: np.ndarray,
+            matching_cost_name: str = "SAD", matching_algorithm_name: str = "WTA",
+            max_disparity: int = 60, filter_radius: int = 3) -> np.ndarray:
+    # Perform stereo matching of a single image pair or a stack of image pairs with the service
+    #   @param[in] left_images: The left stereo image (H,W) or images (N,H,W)
+    #   @param[in] right_images: The right stereo image (H,W) or images (N,H,W)
+    #   @param[in] matching_cost_name: Name of the matching cost type
+    #   @param[in] matching_algorithm_name: Name of the matching algorithm
+    #   @param[in] max_disparity: Maximum disparity to consider
+    #   @param[in] filter_radius: Filter radius to be considered for cost volume
+    #   @return: The disparity image (H,W) or images (N,H,W)
+
+    if (left_images.shape != right_images.shape):
+      raise ValueError("Dimensions of left " + str(left_images.shape) + " and right images " + str(right_images.shape) + " do not match.")
+
+    (left, left_description) = self._get_frame("left", left_images.shape, left_images.dtype)
+    (right, right_description) = self._get_frame("right", right_images.shape, right_images.dtype)
+    (result, result_description) = self._get_frame("result", left_images.shape, np.int64)
+    left[...] = left_images
+    right[...] = right_images
+    self._request({"command": "match", "pid": os.getpid(), "cost": matching_cost_name, "algorithm": matching_algorithm_name,
+                   "max_disparity": max_disparity, "filter_radius": filter_radius,
+                   "left": left_description, "right": right_description, "result": result_description})
+    return result.copy()
+
+  def metrics(self) -> dict:
+    # Get the metrics of the service
+    #   @return: The queue depth, the number of running, completed and failed requests and their latencies
+
+    return self._request({"command": "metrics"})["metrics"]
+
+  def close(self) -> None:
+    # Close the connection and release the shared memory
+
+    if self._connection is not None:
+      self._connection.close()
+      self._connection = None
+    if self._file is not None:
+      self._file.close()
+      self._file = None
+    for segment in self._segments.values():
+      segment.close()
+      segment.unlink()
+    self._segments.clear()
+    return
+
+  def __enter__(self) -> "StereoClient":
+    return self
+
+  def __exit__(self, *args) -> None:
+    self.close()
+    return
+
+  def _get_frame(self, key: str, shape: Tuple[int, ...], dtype: type) -> Tuple[np.ndarray, dict]:
+    # Get an array in shared memory, the shared memory is only created again if it is too small
+    #   @param[in] key: The name of the frame (e.g. left)
+    #   @param[in] shape: The shape of the array
+    #   @param[in] dtype: The data type of the array
+    #   @return: The array and its description to be sent to the service
+
+    size = max(int(np.prod(shape))*np.dtype(dtype).itemsize, 1)
+    segment = self._segments.get(key)
+    if (segment is None) or (segment.size < size):
+      if segment is not None:
+        segment.close()
+        segment.unlink()
+      segment = shared_memory.SharedMemory(create=True, size=size)
+      self._segments[key] = segment
+    array = np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+    return (array, {"name": segment.name, "shape": list(shape), "dtype": np.dtype(dtype).name})
+
+  def _request(self, request: dict) -> dict:
+    # Send a request to the service and wait for its response
+    #   @param[in] request: The request to be encoded
+    #   @return: The decoded response
+
+    data = json.dumps(request).encode()
+    if self._socket_path is not None:
+      if self._connection is None:
+        self._connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._connection.connect(self._socket_path)
+        self._file = self._connection.makefile("rb")
+      self._connection.sendall(data + b"\n")
+      line = self._file.readline()
+      if not line:
+        raise ConnectionError("Stereo matching service closed the connection.")
+      response = json.loads(line)
+    else:
+      if self._connection is None:
+        self._connection = http.client.HTTPConnection(self._host, self._port)
+        self._connection.connect()
+        self._connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+      self._connection.request("POST", "/", body=data, headers={"Content-Type": "application/json"})
+      response = json.loads(self._connection.getresponse().read())
+
+    if response["status"] != "ok":
+      raise RuntimeError("Stereo matching service failed: " + response["message"])
+    return response
+
+
+def _attach(description: dict, segments: List[shared_memory.SharedMemory], is_owner: bool = False) -> np.ndarray:
+  # Attach to an array in shared memory created by another process without taking over its ownership
+  #   @param[in] description: The name, shape and data type of the array
+  #   @param[out] segments: The list the attached shared memory is appended to for closing it afterwards
+  #   @param[in] is_owner: Flag whether the shared memory was created by this process and is tracked already
+  #   @return: The array in shared memory
+
+  segment = shared_memory.SharedMemory(name=description["name"])
+  # Before Python 3.13 attaching registers the shared memory to be unlinked once the service exits
+  if not is_owner:
+    resource_tracker.unregister(segment._name, "shared_memory")
+  segments.append(segment)
+  return np.ndarray(tuple(description["shape"]), dtype=np.dtype(description["dtype"]), buffer=segment.buf)
+
+
+class _UnixRequestHandler(socketserver.StreamRequestHandler):
+  # Handler of a connection to the Unix socket receiving one JSON request per line
+
+  def handle(self) -> None:
+    for line in self.rfile:
+      try:
+        response = self.server.service.handle(json.loads(line))
+      except (ValueError, KeyError, TypeError) as e:
+        response = {"status": "error", "message": "Invalid request: " + str(e)}
+      self.wfile.write(json.dumps(response).encode() + b"\n")
+      self.wfile.flush()
+    return
+
+
+class _HttpRequestHandler(http.server.BaseHTTPRequestHandler):
+  # Handler of HTTP requests receiving a JSON request as body of a POST and returning the metrics for a GET of /metrics
+
+  protocol_version = "HTTP/1.1"
+  disable_nagle_algorithm = True
+
+  def do_GET(self) -> None:
+    if self.path == "/metrics":
+      self._reply(200, {"status": "ok", "metrics": self.server.service.metrics()})
+    else:
+      self._reply(404, {"status": "error", "message": "Path '" + self.path + "' not found!"})
+    return
+
+  def do_POST(self) -> None:
+    try:
+      request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+      response = self.server.service.handle(request)
+    except (ValueError, KeyError, TypeError) as e:
+      response = {"status": "error", "message": "Invalid request: " + str(e)}
+    self._reply(200 if response["status"] == "ok" else 400, response)
+    return
+
+  def log_message(self, format: str, *args) -> None:
+    return
+
+  def _reply(self, code: int, response: dict) -> None:
+    # Send a JSON response
+    #   @param[in] code: The HTTP status code
+    #   @param[in] response: The response to be encoded
+
+    data = json.dumps(response).encode()
+    self.send_response(code)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+    return
+
+
+if __name__== "__main__":
+  # Parse input arguments
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-s", "--socket", type=str,
+                      help="Path of the Unix socket to listen on", default = None)
+  parser.add_argument("-p", "--port", type=int,
+                      help="Port to listen on for HTTP requests from the local machine", default = None)
+  parser.add_argument("-w", "--workers", type=int,
+                      help="Number of requests processed at the same time", default = 1)
+  parser.add_argument("-t", "--threads", type=int,
+                      help="Number of threads of every worker, by default all available threads are shared", default = None)
+  parser.add_argument("-M", "--memory-budget", type=float,
+                      help="Maximum memory in MB to be allocated for every request, for stacks of image pairs by the cost volumes kept in memory at once, by default unlimited", default = None)
+  parser.add_argument("-L", "--threading-layer", type=str, choices=Parallel.threading_layers,
+                      help="Numba threading layer, by default chosen by numba", default = None)
+  args = parser.parse_args()
+
+  if (args.socket is None) and (args.port is None):
+    parser.error("Either a Unix socket (-s) or a port (-p) has to be given.")
+  if args.threading_layer is not None:
+    Parallel.set_threading_layer(args.threading_layer)
+  memory_budget = None if args.memory_budget is None else int(args.memory_budget*1024**2)
+
+  service = StereoService(args.workers, args.threads, memory_budget)
+  print("Compiling kernels...")
+  service.warm_up()
+  if args.socket is not None:
+    service.serve_unix(args.socket)
+    print("Listening on Unix socket '" + args.socket + "'.")
+  if args.port is not None:
+    server = service.serve_http(args.port)
+    print("Listening on http://" + server.server_address[0] + ":" + str(server.server_address[1]) + ".")
+  try:
+    threading.Event().wait()
+  except KeyboardInterrupt:
+    pass
+  service.shutdown()
@@ -5,18 +5,45 @@
 
 from enum import Enum
 import numpy as np
+from typing import List, NamedTuple, Tuple
+import weakref
 
 from matching_algorithm.matching_algorithm import MatchingAlgorithm
 from matching_cost.matching_cost import MatchingCost
+from parallel import Backend, Parallel
+from utilities import PeakMemory
+
+
+class Pipeline(Enum):
+  # Execution strategies for computing the disparity image
+  VOLUME = "volume"     # Assemble the full cost volume and search it with the matching algorithm afterwards
+  FUSED = "fused"       # Fuse the matching cost with a winner-takes-it-all search without storing the cost volume
+  STREAMED = "streamed" # Assemble and search the cost volume in horizontal strips one after another
+
+
+class Plan(NamedTuple):
+  # Execution plan for computing the disparity image
+  #   pipeline:         The execution strategy
+  #   dtype:            The floating point type the images are processed in
+  #   strip_height:     The number of rows computed at once, all rows if not streamed
+  #   estimated_memory: The estimated peak memory in bytes
+  pipeline: Pipeline
+  dtype: type
+  strip_height: int
+  estimated_memory: int
 
 
 class StereoMatching:
   # Recreate the depth image from two images with a given maximum disparity to consider and given filter radius
 
+  _warmed_up = set()
+
   def __init__(self, left_image: np.ndarray, right_image: np.ndarray,
                      matching_cost: MatchingCost, 
                      matching_algorithm: MatchingAlgorithm, 
-                     max_disparity: int = 60, filter_radius: int = 3):
+                     max_disparity: int = 60, filter_radius: int = 3,
+                     memory_budget: int = None, num_threads: int = None, backend: Backend = Backend.NUMBA,
+                     measure_memory: bool = False):
     # Class constructor
     #   @param[in] left_image: The left stereo image (H,W)
     #   @param[in] right_image: The right stereo image (H,W)
@@ -24,6 +51,10 @@ class StereoMatching:
     #   @param[in] matching_algorithm: The class implementing the matching algorithm
     #   @param[in] max_disparity: The maximum disparity to consider
     #   @param[in] filter_radius: The radius of the filter
+    #   @param[in] memory_budget: The maximum memory in bytes to be allocated for stereo matching, None for unlimited
+    #   @param[in] num_threads: The number of threads or processes to be used, None for the maximum number of threads
+    #   @param[in] backend: The parallel backend
+    #   @param[in] measure_memory: Flag for measuring the peak memory, resets the peak memory of the whole process on every computation
 
     if (left_image.ndim != 2):
       raise ValueError("The left image has to be a grey-scale image with a single channel as its last dimension.")
@@ -35,6 +66,11 @@ class StereoMatching:
       raise ValueError("Maximum disparity (" + max_disparity + ") has to be greater than zero.")
     if (filter_radius <= 0):
       raise ValueError("Radius (" + filter_radius + ") has to be greater than zero.")
+    if (memory_budget is not None) and (memory_budget <= 0):
+      raise ValueError("Memory budget (" + str(memory_budget) + ") has to be greater than zero.")
+    if num_threads is None:
+      num_threads = Parallel.max_threads()
+    Parallel.check_backend(backend, num_threads)
 
     # Convert images to gray-scale
     self._left_image = left_image
@@ -44,15 +80,104 @@ class StereoMatching:
     self._filter_radius = filter_radius
     self._matching_cost = matching_cost
     self._matching_algorithm = matching_algorithm
+    self._memory_budget = memory_budget
+    self._num_threads = num_threads
+    self._backend = backend
+    self._measure_memory = measure_memory
     self._cost_volume = None
     self._result = None
+    self._plan = None
+    self._peak_memory = None
+    self._executor = None
+    self._shutdown = None
     return
 
+  def __enter__(self) -> "StereoMatching":
+    # Enter the context, the pool of threads or processes is shut down when leaving it
+    #   @return: The stereo matching object itself
+
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback) -> None:
+    # Leave the context and shut down the pool of threads or processes
+    #   @param[in] exc_type: The type of the exception raised inside the context if any
+    #   @param[in] exc_value: The exception raised inside the context if any
+    #   @param[in] traceback: The traceback of the exception raised inside the context if any
+
+    self.close()
+    return
+
+  def close(self) -> None:
+    # Shut down the pool of threads or processes, a later computation starts a new one
+    # Without closing it the pool is shut down once the stereo matching object is garbage collected or the interpreter exits
+
+    if self._executor is not None:
+      self._shutdown()
+      self._executor = None
+      self._shutdown = None
+    return
+
+  def plan(self) -> Plan:
+    # Choose the fastest valid pipeline and data type for the combination of matching cost and matching algorithm
+    # that stays within the memory budget
+    #   @return: The execution plan
+
+    candidates = []
+    is_fusable = self._matching_cost.is_fusable and self._matching_algorithm.is_fusable
+    is_streamable = self._matching_cost.is_streamable and self._matching_algorithm.is_streamable
+
+    # Fusing the winner-takes-it-all search is the fastest pipeline and does not allocate a cost volume
+    if is_fusable:
+      for dtype in self._get_dtypes(self._matching_cost.supported_dtypes):
+        candidates.append(self._get_strip_plan(Pipeline.FUSED, dtype))
+
+    # Smaller data types are preferred over streaming to avoid recomputing the overlap between the strips
+    # The pools of the other backends can only distribute strips
+    dtypes = self._get_dtypes(tuple(t for t in self._matching_cost.supported_dtypes if t in self._matching_algorithm.supported_dtypes))
+    if self._backend == Backend.NUMBA:
+      for dtype in dtypes:
+        candidates.append(self._get_plan(Pipeline.VOLUME, dtype))
+    if is_streamable:
+      for dtype in dtypes:
+        candidates.append(self._get_strip_plan(Pipeline.STREAMED, dtype))
+
+    if (not candidates) and (self._backend != Backend.NUMBA) and (not is_fusable) and (not is_streamable):
+      raise ValueError("Backend '" + self._backend.value + "' requires a matching cost and matching algorithm that can be fused or streamed.")
+    if not candidates:
+      raise ValueError("Matching cost '" + str(self._matching_cost.name) + "' and matching algorithm '" +
+                       str(self._matching_algorithm.name) + "' do not share a common data type.")
+    if self._memory_budget is None:
+      return candidates[0]
+    for candidate in candidates:
+      if candidate.estimated_memory <= self._memory_budget:
+        return candidate
+
+    min_memory = min(candidate.estimated_memory for candidate in candidates)
+    raise MemoryError("Stereo matching requires an estimated peak memory of at least " + PeakMemory.str_megabytes(min_memory) +
+                      " which exceeds the memory budget of " + PeakMemory.str_megabytes(self._memory_budget) + ".")
+
   def compute(self) -> None:
     # Compute the cost volume according to given matching cost and match according matching algorithm
+    # Depending on the plan both steps are fused or performed in strips and the cost volume is not stored
+
+    self._plan = self.plan()
+
+    # Measuring the peak memory resets it for the whole process, e.g. also for other threads performing stereo matching
+    if not self._measure_memory:
+      self._execute()
+      return
+
+    # Compile the kernels on small random images once so that the compiler does not distort the measured peak memory
+    warm_up_key = (self._matching_cost, self._matching_algorithm, self._plan.pipeline, self._plan.dtype)
+    if warm_up_key not in StereoMatching._warmed_up:
+      size = 2*self._filter_radius + 2
+      warm_up_image = np.random.default_rng(0).random((size, size)).astype(self._plan.dtype)
+      self._run(warm_up_image, warm_up_image, self._plan._replace(strip_height=1), Backend.NUMBA, 1)
+      StereoMatching._warmed_up.add(warm_up_key)
 
-    self._cost_volume = self._matching_cost.compute(self._left_image, self._right_image, self._max_disparity, self._filter_radius)
-    self._result = self._matching_algorithm.match(self._cost_volume)
+    with PeakMemory() as peak_memory:
+      self._execute()
+    self._peak_memory = peak_memory.result()
     return
   
   def result(self) -> np.ndarray:
@@ -60,3 +185,207 @@ class StereoMatching:
     #   @return: The generated result image or None if the image has not been generated yet
 
     return self._result
+
+  def estimated_memory(self) -> int:
+    # Get the peak memory predicted for the last computation
+    #   @return: The estimated peak memory in bytes or None if nothing has been computed yet
+
+    if self._plan is None:
+      return None
+    return self._plan.estimated_memory
+
+  def peak_memory(self) -> int:
+    # Get the peak memory measured during the last computation, only of this process for the process backend
+    #   @return: The measured peak memory in bytes or None if it is not available or was not asked for by measure_memory
+
+    return self._peak_memory
+
+  def _execute(self) -> None:
+    # Execute the plan on the images converted to its data type
+
+    left_image = self._left_image.astype(self._plan.dtype, copy=False)
+    right_image = self._right_image.astype(self._plan.dtype, copy=False)
+    (self._cost_volume, self._result) = self._run(left_image, right_image, self._plan, self._backend, self._num_threads)
+    return
+
+  def _run(self, left_image: np.ndarray, right_image: np.ndarray, plan: Plan,
+           backend: Backend, num_threads: int) -> Tuple[np.ndarray, np.ndarray]:
+    # Execute a plan on the given images
+    #   @param[in] left_image: The left stereo image converted to the data type of the plan (H,W)
+    #   @param[in] right_image: The right stereo image converted to the data type of the plan (H,W)
+    #   @param[in] plan: The execution plan
+    #   @param[in] backend: The parallel backend
+    #   @param[in] num_threads: The number of threads or processes to be used
+    #   @return: The cost volume or None if it is not stored (H,W,D) as well as the disparity image (H,W)
+
+    # The pool is started by the first computation and reused by the following ones
+    if (backend != Backend.NUMBA) and (self._executor is None):
+      self._executor = Parallel.executor(backend, num_threads)
+      self._shutdown = weakref.finalize(self, self._executor.shutdown)
+
+    if plan.pipeline == Pipeline.VOLUME:
+      arguments = [(self._matching_cost, self._matching_algorithm, left_image, right_image, self._max_disparity, self._filter_radius)]
+      return Parallel.map(StereoMatching._compute_volume, arguments, backend, num_threads, self._executor)[0]
+
+    # Rows inside the filter radius of the strip border have to be computed from the neighbouring rows
+    (H,_) = left_image.shape
+    strips = []
+    for y_start in range(0, H, plan.strip_height):
+      y_end = min(y_start + plan.strip_height, H)
+      strips.append((y_start, y_end, max(y_start - self._filter_radius, 0), min(y_end + self._filter_radius, H)))
+    is_fused = (plan.pipeline == Pipeline.FUSED)
+    arguments = [(self._matching_cost, self._matching_algorithm, left_image[strip_start:strip_end], right_image[strip_start:strip_end],
+                  self._max_disparity, self._filter_radius, is_fused) for (_, _, strip_start, strip_end) in strips]
+    results = Parallel.map(StereoMatching._compute_strip, arguments, backend, num_threads, self._executor)
+    if len(results) == 1:
+      return None, results[0]
+
+    result = np.zeros(left_image.shape, dtype=results[0].dtype)
+    for ((y_start, y_end, strip_start, _), strip) in zip(strips, results):
+      result[y_start:y_end] = strip[y_start-strip_start:y_end-strip_start]
+    return None, result
+
+  @staticmethod
+  def _compute_volume(matching_cost: MatchingCost, matching_algorithm: MatchingAlgorithm,
+                      left_image: np.ndarray, right_image: np.ndarray,
+                      max_disparity: int, filter_radius: int) -> Tuple[np.ndarray, np.ndarray]:
+    # Compute the full cost volume and match it
+    #   @param[in] matching_cost: The class implementing the matching cost
+    #   @param[in] matching_algorithm: The class implementing the matching algorithm
+    #   @param[in] left_image: The left stereo image (H,W)
+    #   @param[in] right_image: The right stereo image (H,W)
+    #   @param[in] max_disparity: The maximum disparity to consider
+    #   @param[in] filter_radius: The radius of the filter
+    #   @return: The cost volume (H,W,D) as well as the disparity image (H,W)
+
+    cost_volume = StereoMatching._convert_layout(matching_cost, matching_algorithm,
+                                                 matching_cost.compute(left_image, right_image, max_disparity, filter_radius))
+    return cost_volume, matching_algorithm.match(cost_volume)
+
+  @staticmethod
+  def _compute_strip(matching_cost: MatchingCost, matching_algorithm: MatchingAlgorithm,
+                     left_image: np.ndarray, right_image: np.ndarray,
+                     max_disparity: int, filter_radius: int, is_fused: bool) -> np.ndarray:
+    # Compute the disparity image of a single strip without keeping its cost volume
+    #   @param[in] matching_cost: The class implementing the matching cost
+    #   @param[in] matching_algorithm: The class implementing the matching algorithm
+    #   @param[in] left_image: The strip of the left stereo image including the overlap (h,W)
+    #   @param[in] right_image: The strip of the right stereo image including the overlap (h,W)
+    #   @param[in] max_disparity: The maximum disparity to consider
+    #   @param[in] filter_radius: The radius of the filter
+    #   @param[in] is_fused: Flag for fusing the matching cost with a winner-takes-it-all search
+    #   @return: The disparity image of the strip (h,W)
+
+    if is_fused:
+      return matching_cost.compute_wta(left_image, right_image, max_disparity, filter_radius)
+    cost_volume = StereoMatching._convert_layout(matching_cost, matching_algorithm,
+                                                 matching_cost.compute(left_image, right_image, max_disparity, filter_radius))
+    return matching_algorithm.match(cost_volume)
+
+  @staticmethod
+  def _convert_layout(matching_cost: MatchingCost, matching_algorithm: MatchingAlgorithm, cost_volume: np.ndarray) -> np.ndarray:
+    # Copy the cost volume into the memory layout the matching algorithm accesses most efficiently if the matching cost assembles it differently
+    #   @param[in] matching_cost: The class implementing the matching cost
+    #   @param[in] matching_algorithm: The class implementing the matching algorithm
+    #   @param[in] cost_volume: The cost volume in the memory layout of the matching cost (H,W,D)
+    #   @return: The cost volume in the memory layout of the matching algorithm (H,W,D)
+
+    if matching_cost.volume_layout == matching_algorithm.volume_layout:
+      return cost_volume
+    if matching_algorithm.volume_layout == "DHW":
+      return np.transpose(np.ascontiguousarray(np.transpose(cost_volume, (2, 0, 1))), (1, 2, 0))
+    return np.ascontiguousarray(cost_volume)
+
+  def _get_dtypes(self, supported_dtypes: tuple) -> List[type]:
+    # Order the supported data types by preference, keeping the data type of the images if possible to avoid a conversion
+    #   @param[in] supported_dtypes: The data types supported by the pipeline
+    #   @return: The supported data types starting with the data type of the images followed by decreasing precision
+
+    dtypes = sorted(supported_dtypes, key=lambda t: np.dtype(t).itemsize, reverse=True)
+    image_dtype = self._left_image.dtype.type
+    if image_dtype in dtypes:
+      dtypes.remove(image_dtype)
+      dtypes.insert(0, image_dtype)
+    return dtypes
+
+  def _get_plan(self, pipeline: Pipeline, dtype: type, strip_height: int = None) -> Plan:
+    # Estimate the peak memory of a pipeline
+    #   @param[in] pipeline: The execution strategy
+    #   @param[in] dtype: The floating point type the images are processed in
+    #   @param[in] strip_height: The number of rows computed at once by the fused and the streamed pipeline
+    #   @return: The execution plan including the estimated memory
+
+    (H,W) = self._left_image.shape
+    D = self._max_disparity
+
+    # Converted copies of the input images
+    memory = 0
+    if self._left_image.dtype.type != dtype:
+      memory += 2*H*W*np.dtype(dtype).itemsize
+
+    if pipeline == Pipeline.VOLUME:
+      strip_height = H
+      memory += self._get_volume_memory((H,W), dtype)
+      return Plan(pipeline, dtype, strip_height, memory)
+
+    # Strips including the overlap that are processed at the same time
+    rows = min(strip_height + 2*self._filter_radius, H)
+    number_of_strips = -(-H//strip_height)
+    if pipeline == Pipeline.FUSED:
+      strip_memory = self._matching_cost.estimate_fused_memory((rows,W), D, dtype)
+    else:
+      strip_memory = self._get_volume_memory((rows,W), dtype)
+    memory += min(self._get_number_of_workers(), number_of_strips)*strip_memory
+
+    # Disparity images of all strips and the assembled disparity image
+    if number_of_strips > 1:
+      memory += 2*H*W*np.dtype(np.int64).itemsize
+    return Plan(pipeline, dtype, strip_height, memory)
+
+  def _get_volume_memory(self, image_shape: Tuple[int, int], dtype: type) -> int:
+    # Estimate the memory of computing and matching a cost volume including its conversion into the layout of the matching algorithm
+    #   @param[in] image_shape: The shape of the images or strips the cost volume is computed for (H,W)
+    #   @param[in] dtype: The floating point type the images are processed in
+    #   @return: The estimated memory in bytes
+
+    (H,W) = image_shape
+    D = self._max_disparity
+    memory = self._matching_cost.estimate_memory((H,W), D, dtype) + self._matching_algorithm.estimate_memory((H,W,D), dtype)
+    if self._matching_cost.volume_layout != self._matching_algorithm.volume_layout:
+      memory += H*W*D*np.dtype(dtype).itemsize
+    return memory
+
+  def _get_strip_plan(self, pipeline: Pipeline, dtype: type) -> Plan:
+    # Find the highest strips that stay within the memory budget, at most one strip for every worker of the backend
+    #   @param[in] pipeline: The execution strategy working on strips
+    #   @param[in] dtype: The floating point type the images are processed in
+    #   @return: The execution plan with the highest strips within the budget or the plan with the least memory if none fits
+
+    (H,_) = self._left_image.shape
+    max_strip_height = -(-H//self._get_number_of_workers())
+    plan = self._get_plan(pipeline, dtype, max_strip_height)
+    if (self._memory_budget is None) or (plan.estimated_memory <= self._memory_budget):
+      return plan
+
+    # The estimated memory grows with the strip height once the image is split
+    (lower, upper) = (1, max_strip_height)
+    while lower < upper:
+      middle = (lower + upper + 1)//2
+      if self._get_plan(pipeline, dtype, middle).estimated_memory <= self._memory_budget:
+        lower = middle
+      else:
+        upper = middle - 1
+    strip_plan = self._get_plan(pipeline, dtype, lower)
+
+    # Splitting adds the disparity images of the strips and does not reduce the memory if it is not dominated by the strips
+    if (strip_plan.estimated_memory > self._memory_budget) and (plan.estimated_memory < strip_plan.estimated_memory):
+      return plan
+    return strip_plan
+
+  def _get_number_of_workers(self) -> int:
+    # Get the number of strips processed at the same time
+    #   @return: The number of threads or processes of the pool or one for the numba backend
+
+    if self._backend == Backend.NUMBA:
+      return 1
+    return self._num_threads
@@ -1,10 +1,11 @@
 # Tobit Flatscher - github.com/2b-t (2022)
 
 # @file utilities.py
-# @brief Different utilities for AccX accuracy measure and file input and output
+# @brief Different utilities for AccX accuracy measure, file input and output and memory measurement
 
 import numpy as np
 import os
+import re
 
 from skimage import img_as_float, img_as_ubyte
 from skimage.io import imread, imsave
@@ -106,4 +107,66 @@ class IO:
       raise ValueError("Maximum value in image must be greater than 0.")
 
     return normalised_image/np.max(normalised_image)
-  
\ No newline at end of file
+
+
+class PeakMemory:
+  # Context manager for measuring the increase of the peak resident memory of the process inside its scope
+  # Relies on the Linux proc file system, on other platforms no measurement is available
+
+  _status_file = "/proc/self/status"
+  _clear_refs_file = "/proc/self/clear_refs"
+
+  def __init__(self):
+    # Class constructor
+
+    self._initial_memory = None
+    self._peak_memory = None
+    return
+
+  def __enter__(self) -> "PeakMemory":
+    # Reset the peak resident memory and store the current resident memory
+    #   @return: The context manager itself
+
+    try:
+      with open(PeakMemory._clear_refs_file, "w") as f:
+        f.write("5")
+      self._initial_memory = PeakMemory._read_status("VmRSS")
+    except (OSError, ValueError):
+      self._initial_memory = None
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback) -> None:
+    # Compute the increase of the peak resident memory since entering the context
+
+    if self._initial_memory is not None:
+      self._peak_memory = max(PeakMemory._read_status("VmHWM") - self._initial_memory, 0)
+    return
+
+  def result(self) -> int:
+    # Get the measured peak memory
+    #   @return: The increase of the peak resident memory in bytes or None if it could not be measured
+
+    return self._peak_memory
+
+  @staticmethod
+  def str_megabytes(number_of_bytes: int) -> str:
+    # Create a human-readable string from a number of bytes
+    #   @param[in] number_of_bytes: The number of bytes or None if not available
+    #   @return: A string of the number of megabytes with 1 decimal
+
+    if number_of_bytes is None:
+      return "n/a"
+    return "{:.1f} MB".format(number_of_bytes/1024**2)
+
+  @staticmethod
+  def _read_status(key: str) -> int:
+    # Read a memory entry from the status of the current process
+    #   @param[in] key: The name of the entry (e.g. VmRSS, VmHWM)
+    #   @return: The value of the entry in bytes
+
+    with open(PeakMemory._status_file, "r") as f:
+      match = re.search(key + r":\s+(\d+) kB", f.read())
+    if match is None:
+      raise ValueError("Entry '" + key + "' not found in process status!")
+    return int(match.group(1))*1024
+
@@ -0,0 +1,126 @@
+# Tobit Flatscher - github.com/2b-t (2022)
+
+# @file reference.py
+# @brief Fixtures and tolerances for testing optimised code paths against the reference implementations
+
+import numpy as np
+import os
+import time
+from typing import Callable, List, Tuple
+
+from utilities import IO
+
+
+class Reference:
+  # Image pairs, parameters and tolerances shared by the tests comparing the optimised code paths (fused, batched, streamed
+  # and parallel) to the reference implementations compute of the matching costs and match of the matching algorithms
+  #   parameters: Combinations of maximum disparity and filter radius every image pair is tested with
+  #   tolerances: Relative and absolute tolerances of the costs per data type, a disparity may only differ from the reference
+  #               where the reference costs of both disparities are equal within these tolerances (a tie) as rounding may
+  #               then resolve the tie differently (e.g. the messages of semi-global matching in single precision)
+  #   slack:      Factor an optimised code path may be slower than its expected speed-up before the timing test fails
+  #   is_timing:  Flag for the timing tests, as they depend on the load of the machine they are only turned on by setting the
+  #               environment variable STEREO_MATCHING_TIMING
+
+  parameters = [ ["D1_R1",  1, 1],
+                 ["D4_R1",  4, 1],
+                 ["D8_R2",  8, 2],
+                 ["D16_R3", 16, 3]
+               ]
+  dtypes = [ ["float64", np.float64],
+             ["float32", np.float32]
+           ]
+  tolerances = { np.float64: {"rtol": 1e-10, "atol": 1e-10},
+                 np.float32: {"rtol": 1e-5,  "atol": 1e-5}
+               }
+  slack = 1.5
+  is_timing = os.environ.get("STEREO_MATCHING_TIMING") is not None
+
+  _data_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+  _crops = [ ["cones",      (slice(150, 182), slice(200, 248))],
+             ["Adirondack", (slice(200, 232), slice(300, 348))]
+           ]
+  _image_pairs = None
+
+  @staticmethod
+  def image_pairs() -> List[Tuple[str, np.ndarray, np.ndarray]]:
+    # Get the image pairs the optimised code paths are tested on: seeded random images of random size and shift,
+    # images with few grey levels resulting in ties between disparities, images with a region of constant intensity
+    # as well as crops of the bundled images
+    #   @return: The name, the left and the right image (H,W) of every pair
+
+    if Reference._image_pairs is None:
+      image_pairs = []
+      for seed in range(3):
+        rng = np.random.default_rng(seed)
+        left_image = rng.random((rng.integers(12, 33), rng.integers(24, 49)))
+        right_image = np.roll(left_image, rng.integers(0, 9), axis=1) + 0.05*rng.random(left_image.shape)
+        image_pairs.append(["random_" + str(seed), left_image, right_image])
+
+      rng = np.random.default_rng(42)
+      left_image = rng.integers(0, 4, (20, 30))/4
+      image_pairs.append(["ties", left_image, np.roll(left_image, 3, axis=1)])
+
+      # Windows inside a region of constant intensity have no variance
+      left_image = rng.random((24, 32))
+      left_image[4:16, 6:22] = 0.5
+      image_pairs.append(["flat", left_image, np.roll(left_image, 2, axis=1)])
+
+      for (name, crop) in Reference._crops:
+        left_image = IO.import_image(os.path.join(Reference._data_path, name + "_left.png"))[crop]
+        right_image = IO.import_image(os.path.join(Reference._data_path, name + "_right.png"))[crop]
+        image_pairs.append([name, np.ascontiguousarray(left_image), np.ascontiguousarray(right_image)])
+      Reference._image_pairs = image_pairs
+    return Reference._image_pairs
+
+  @staticmethod
+  def assert_cost_volume(actual: np.ndarray, expected: np.ndarray, dtype: type) -> None:
+    # Assert that a cost volume matches the reference within the tolerances of its data type
+    #   @param[in] actual: The cost volume of the optimised code path
+    #   @param[in] expected: The cost volume of the reference implementation
+    #   @param[in] dtype: The data type the optimised code path was run with
+
+    tolerance = Reference.tolerances[dtype]
+    np.testing.assert_allclose(actual, expected, rtol=tolerance["rtol"], atol=tolerance["atol"])
+    return
+
+  @staticmethod
+  def assert_disparity(actual: np.ndarray, expected: np.ndarray, aggregated_costs: np.ndarray, dtype: type) -> None:
+    # Assert that a disparity image matches the reference except for ties within the tolerances of its data type
+    #   @param[in] actual: The disparity image of the optimised code path
+    #   @param[in] expected: The disparity image of the reference implementation
+    #   @param[in] aggregated_costs: The reference costs the disparity with the lowest cost is chosen from, see MatchingAlgorithm.aggregate (H,W,D)
+    #   @param[in] dtype: The data type the optimised code path was run with
+
+    if (actual.shape != expected.shape):
+      raise AssertionError("Dimensions of disparity image " + str(actual.shape) + " and reference " + str(expected.shape) + " do not match.")
+    (y, x) = np.nonzero(actual != expected)
+    actual_costs = aggregated_costs[y, x, actual[y, x].astype(np.int64)]
+    expected_costs = aggregated_costs[y, x, expected[y, x].astype(np.int64)]
+    tolerance = Reference.tolerances[dtype]
+    is_tie = np.abs(actual_costs - expected_costs) <= tolerance["atol"] + tolerance["rtol"]*np.abs(expected_costs)
+    if not np.all(is_tie):
+      i = np.argmin(is_tie)
+      raise AssertionError("Disparity image differs from reference in " + str(np.count_nonzero(~is_tie)) + " pixels that are no ties, e.g. at " +
+                           str((y[i], x[i])) + " with disparity " + str(actual[y[i], x[i]]) + " instead of " + str(expected[y[i], x[i]]) + ".")
+    return
+
+  @staticmethod
+  def speed_up(reference: Callable, optimised: Callable, repetitions: int = 7) -> float:
+    # Measure the speed-up of an optimised code path over the reference after running both once for compiling them
+    # The runs alternate between both functions so that a temporary load of the machine affects both of them
+    #   @param[in] reference: The function calling the reference implementation
+    #   @param[in] optimised: The function calling the optimised code path
+    #   @param[in] repetitions: The number of repetitions, the fastest one of each function is compared
+    #   @return: The ratio of the run time of the reference to the one of the optimised code path
+
+    functions = [reference, optimised]
+    run_times = [np.inf, np.inf]
+    for function in functions:
+      function()
+    for _ in range(repetitions):
+      for (i, function) in enumerate(functions):
+        start_time = time.perf_counter()
+        function()
+        run_times[i] = min(run_times[i], time.perf_counter() - start_time)
+    return run_times[0]/run_times[1]
@@ -0,0 +1,156 @@
+# Tobit Flatscher - github.com/2b-t (2022)
+
+# @file test_batch_stereo_matching.py
+# @brief Testing routines for stereo matching of stacks of image pairs and the pool of scratch buffers
+
+import numpy as np
+from parameterized import parameterized
+import unittest
+
+from batch_stereo_matching import BatchStereoMatching, BufferPool
+from matching_algorithm import MatchingAlgorithm, SemiGlobalMatching, WinnerTakesItAll
+from matching_cost import MatchingCost, NormalisedCrossCorrelation, SumOfAbsoluteDifferences, SumOfSquaredDifferences
+from stereo_matching import StereoMatching
+from test.reference import Reference
+
+
+class TestBatchStereoMatching(unittest.TestCase):
+  _shape = (5, 16, 20)
+  _max_disparity = 5
+  _filter_radius = 2
+  _combinations = [ ["NCC_WTA", NormalisedCrossCorrelation, WinnerTakesItAll],
+                    ["SAD_WTA", SumOfAbsoluteDifferences,   WinnerTakesItAll],
+                    ["SSD_WTA", SumOfSquaredDifferences,    WinnerTakesItAll],
+                    ["NCC_SGM", NormalisedCrossCorrelation, SemiGlobalMatching],
+                    ["SAD_SGM", SumOfAbsoluteDifferences,   SemiGlobalMatching],
+                    ["SSD_SGM", SumOfSquaredDifferences,    SemiGlobalMatching]
+                  ]
+
+  @parameterized.expand(_combinations)
+  def test_same_result(self, name: str, matching_cost: MatchingCost, matching_algorithm: MatchingAlgorithm) -> None:
+    # Parameterised unit test for testing if a stack of image pairs results in the same disparity images as single pairs
+    #   @param[in] name: The name of the parameterised test
+    #   @param[in] matching_cost: The matching cost to be tested
+    #   @param[in] matching_algorithm: The matching algorithm to be tested
+
+    rng = np.random.default_rng(42)
+    left_images = rng.random(self._shape)
+    right_images = np.roll(left_images, 2, axis=2)
+
+    # Chunks that do not divide the number of pairs and repeated calls reuse the scratch buffers
+    bsm = BatchStereoMatching(matching_cost, matching_algorithm, self._max_disparity, self._filter_radius, chunk_size=2)
+    for _ in range(2):
+      result = bsm.compute(left_images, right_images)
+      self.assertEqual(result.shape, self._shape)
+      for n in range(self._shape[0]):
+        sm = StereoMatching(left_images[n], right_images[n], matching_cost, matching_algorithm, self._max_disparity, self._filter_radius)
+        sm.compute()
+        np.testing.assert_array_equal(result[n], sm.result())
+    return
+
+  @parameterized.expand(_combinations)
+  def test_flat_window(self, name: str, matching_cost: MatchingCost, matching_algorithm: MatchingAlgorithm) -> None:
+    # Parameterised unit test for testing if windows without texture result in the same disparity images as single pairs,
+    # also when being called repeatedly
+    #   @param[in] name: The name of the parameterised test
+    #   @param[in] matching_cost: The matching cost to be tested
+    #   @param[in] matching_algorithm: The matching algorithm to be tested
+
+    rng = np.random.default_rng(42)
+    left_images = rng.random(self._shape)
+    left_images[:, 4:12, 5:15] = 0.5
+    right_images = np.roll(left_images, 2, axis=2)
+
+    bsm = BatchStereoMatching(matching_cost, matching_algorithm, self._max_disparity, self._filter_radius)
+    for _ in range(2):
+      result = bsm.compute(left_images, right_images)
+      for n in range(self._shape[0]):
+        cost_volume = matching_cost.compute(left_images[n], right_images[n], self._max_disparity, self._filter_radius)
+        np.testing.assert_array_equal(result[n], matching_algorithm.match(cost_volume))
+    return
+
+  def test_memory_budget(self) -> None:
+    # Function for testing if a memory budget reduces the number of cost volumes kept in memory at once and a too small one
+    # results in a MemoryError
+
+    rng = np.random.default_rng(42)
+    left_images = rng.random(self._shape)
+    right_images = np.roll(left_images, 2, axis=2)
+    (N,H,W) = self._shape
+    pair_memory = SumOfAbsoluteDifferences.estimate_memory((H,W), self._max_disparity, np.float64) + \
+                  SemiGlobalMatching.estimate_memory((H,W,self._max_disparity), np.float64)
+
+    expected_result = BatchStereoMatching(SumOfAbsoluteDifferences, SemiGlobalMatching, self._max_disparity, self._filter_radius).compute(left_images, right_images)
+    bsm = BatchStereoMatching(SumOfAbsoluteDifferences, SemiGlobalMatching, self._max_disparity, self._filter_radius, memory_budget=2*pair_memory)
+    np.testing.assert_array_equal(bsm.compute(left_images, right_images), expected_result)
+    self.assertLessEqual(bsm.buffer_pool().size(), 2*pair_memory)
+    bsm = BatchStereoMatching(SumOfAbsoluteDifferences, SemiGlobalMatching, self._max_disparity, self._filter_radius, memory_budget=pair_memory - 1)
+    self.assertRaises(MemoryError, bsm.compute, left_images, right_images)
+    self.assertRaises(ValueError, BatchStereoMatching, SumOfAbsoluteDifferences, SemiGlobalMatching, self._max_disparity, self._filter_radius,
+                      memory_budget=0)
+    return
+
+  def test_invalid_shape(self) -> None:
+    # Function for testing if stacks of images of different shapes result in a ValueError
+
+    bsm = BatchStereoMatching(SumOfAbsoluteDifferences, WinnerTakesItAll, self._max_disparity, self._filter_radius)
+    self.assertRaises(ValueError, bsm.compute, np.zeros(self._shape), np.zeros(self._shape[1:]))
+    self.assertRaises(ValueError, bsm.compute, np.zeros(self._shape), np.zeros((4, 16, 20)))
+    return
+
+
+@unittest.skipUnless(Reference.is_timing, "Timing tests turned off")
+class TestBatchStereoMatchingTiming(unittest.TestCase):
+  # A stack of small image pairs is expected to be at least as fast as stereo matching one pair after another, semi-global
+  # matching by a wide margin as its reference is only partially compiled, the fused winner-takes-it-all search is bound by
+  # the arithmetic of the windows so that on a single thread batching only saves the overhead of the calls
+  _shape = (16, 64, 64)
+  _max_disparity = 16
+  _filter_radius = 2
+  _expected_speed_ups = {"SGM": 4.0}
+  _combinations = TestBatchStereoMatching._combinations
+
+  @parameterized.expand(_combinations)
+  def test_compute(self, name: str, matching_cost: MatchingCost, matching_algorithm: MatchingAlgorithm) -> None:
+    # Parameterised unit test for testing if stereo matching a stack of image pairs is not slower than expected
+    #   @param[in] name: The name of the parameterised test
+    #   @param[in] matching_cost: The matching cost to be tested
+    #   @param[in] matching_algorithm: The matching algorithm to be tested
+
+    rng = np.random.default_rng(42)
+    left_images = rng.random(self._shape)
+    right_images = np.roll(left_images, 3, axis=2)
+
+    def compute_pairs() -> None:
+      for n in range(self._shape[0]):
+        sm = StereoMatching(left_images[n], right_images[n], matching_cost, matching_algorithm, self._max_disparity, self._filter_radius)
+        sm.compute()
+      return
+
+    bsm = BatchStereoMatching(matching_cost, matching_algorithm, self._max_disparity, self._filter_radius)
+    speed_up = Reference.speed_up(compute_pairs, lambda: bsm.compute(left_images, right_images), repetitions = 3)
+    expected_speed_up = self._expected_speed_ups.get(matching_algorithm.name, 1.0)
+    self.assertGreaterEqual(speed_up, expected_speed_up/Reference.slack,
+                            "Optimised code path is slower than expected with a speed-up of " + str(round(speed_up, 2)) + ".")
+    return
+
+
+class TestBufferPool(unittest.TestCase):
+
+  def test_reuse(self) -> None:
+    # Function for testing if buffers are reused for the same or a smaller first dimension and replaced otherwise
+
+    pool = BufferPool()
+    buffer = pool.get("a", (4, 3, 2), np.float64)
+    self.assertEqual(buffer.shape, (4, 3, 2))
+    self.assertTrue(np.shares_memory(pool.get("a", (2, 3, 2), np.float64), buffer))
+    self.assertEqual(pool.get("a", (2, 3, 2), np.float64).shape, (2, 3, 2))
+    self.assertFalse(np.shares_memory(pool.get("a", (4, 3, 2), np.float32), buffer))
+    self.assertEqual(pool.size(), 4*3*2*4)
+    pool.clear()
+    self.assertEqual(pool.size(), 0)
+    return
+
+
+if __name__ == '__main__':
+  unittest.main()
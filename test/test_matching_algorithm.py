@@ -0,0 +1,101 @@
+# Tobit Flatscher - github.com/2b-t (2022)
+
+# @file test_matching_algorithm.py
+# @brief Testing routines for the optimised code paths of all registered matching algorithms against their reference implementation
+
+import numpy as np
+from parameterized import parameterized
+import unittest
+
+from batch_stereo_matching import BufferPool
+from matching_algorithm import MatchingAlgorithm
+from matching_cost import MatchingCost
+from test.reference import Reference
+
+
+class TestMatchingAlgorithm(unittest.TestCase):
+  # The disparity image computed by match from a cost volume in double precision is the reference for every data type and code path
+  _combinations = [ [name + "_" + dtype_name, MatchingAlgorithm.from_name(name), dtype]
+                    for name in MatchingAlgorithm.names() for (dtype_name, dtype) in Reference.dtypes ]
+
+  def _get_cases(self, matching_algorithm: MatchingAlgorithm, dtype: type) -> list:
+    # Get the reference disparity images for the cost volumes of all registered matching costs, image pairs and parameters
+    #   @param[in] matching_algorithm: The matching algorithm to be tested
+    #   @param[in] dtype: The data type the optimised code path is run with
+    #   @return: The name of the case, the cost volume converted to the data type, the reference disparity image and aggregated costs
+
+    if dtype not in matching_algorithm.supported_dtypes:
+      self.skipTest("Data type " + np.dtype(dtype).name + " not supported by matching algorithm '" + matching_algorithm.name + "'.")
+    cases = []
+    for matching_cost_name in MatchingCost.names():
+      for (image_name, left_image, right_image) in Reference.image_pairs():
+        for (parameter_name, max_disparity, filter_radius) in Reference.parameters:
+          cost_volume = MatchingCost.from_name(matching_cost_name).compute(left_image, right_image, max_disparity, filter_radius)
+          cases.append((matching_cost_name + "_" + image_name + "_" + parameter_name, np.ascontiguousarray(cost_volume, dtype=dtype),
+                        matching_algorithm.match(cost_volume), matching_algorithm.aggregate(cost_volume)))
+    return cases
+
+  @parameterized.expand(_combinations)
+  def test_match(self, name: str, matching_algorithm: MatchingAlgorithm, dtype: type) -> None:
+    # Parameterised unit test for testing if the disparity image of every supported data type matches the reference
+    #   @param[in] name: The name of the parameterised test
+    #   @param[in] matching_algorithm: The matching algorithm to be tested
+    #   @param[in] dtype: The data type to be tested
+
+    for (case, cost_volume, expected_result, aggregated_costs) in self._get_cases(matching_algorithm, dtype):
+      with self.subTest(case):
+        Reference.assert_disparity(matching_algorithm.match(cost_volume), expected_result, aggregated_costs, dtype)
+    return
+
+  @parameterized.expand(_combinations)
+  def test_match_batch(self, name: str, matching_algorithm: MatchingAlgorithm, dtype: type) -> None:
+    # Parameterised unit test for testing if matching a stack of cost volumes results in the reference disparity images
+    # The scratch buffers are reused between the cost volumes so that stale values are detected
+    #   @param[in] name: The name of the parameterised test
+    #   @param[in] matching_algorithm: The matching algorithm to be tested
+    #   @param[in] dtype: The data type to be tested
+
+    buffer_pool = BufferPool()
+    for (case, cost_volume, expected_result, aggregated_costs) in self._get_cases(matching_algorithm, dtype):
+      with self.subTest(case):
+        # The second volume is the first one mirrored so that all volumes of the stack differ
+        cost_volumes = np.stack([cost_volume, cost_volume[::-1]])
+        mirrored_volume = cost_volume[::-1].astype(np.float64)
+        expected_results = [expected_result, matching_algorithm.match(mirrored_volume)]
+        expected_costs = [aggregated_costs, matching_algorithm.aggregate(mirrored_volume)]
+        disparity_images = np.full(cost_volumes.shape[:3], -1, dtype=np.int64)
+        matching_algorithm.match_batch(cost_volumes, disparity_images, buffer_pool.get)
+        for n in range(cost_volumes.shape[0]):
+          Reference.assert_disparity(disparity_images[n], expected_results[n], expected_costs[n], dtype)
+    return
+
+
+@unittest.skipUnless(Reference.is_timing, "Timing tests turned off")
+class TestMatchingAlgorithmTiming(unittest.TestCase):
+  # Matching a stack of cost volumes is expected to be at least as fast as matching one cost volume after another,
+  # semi-global matching by a wide margin as its reference is only partially compiled
+  _volume_shape = (32, 24, 32, 8)
+  _expected_speed_ups = {"SGM": 5.0}
+  _matching_algorithms = [ [name, MatchingAlgorithm.from_name(name)] for name in MatchingAlgorithm.names() ]
+
+  @parameterized.expand(_matching_algorithms)
+  def test_match_batch(self, name: str, matching_algorithm: MatchingAlgorithm) -> None:
+    # Parameterised unit test for testing if matching a stack of cost volumes is not slower than expected
+    #   @param[in] name: The name of the parameterised test
+    #   @param[in] matching_algorithm: The matching algorithm to be tested
+
+    rng = np.random.default_rng(42)
+    cost_volumes = rng.random(self._volume_shape)
+    disparity_images = np.empty(self._volume_shape[:3], dtype=np.int64)
+    buffer_pool = BufferPool()
+
+    speed_up = Reference.speed_up(lambda: [matching_algorithm.match(cost_volume) for cost_volume in cost_volumes],
+                                  lambda: matching_algorithm.match_batch(cost_volumes, disparity_images, buffer_pool.get))
+    expected_speed_up = self._expected_speed_ups.get(name, 1.0)
+    self.assertGreaterEqual(speed_up, expected_speed_up/Reference.slack,
+                            "Optimised code path is slower than expected with a speed-up of " + str(round(speed_up, 2)) + ".")
+    return
+
+
+if __name__ == '__main__':
+  unittest.main()
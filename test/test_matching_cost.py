@@ -0,0 +1,157 @@
+# Tobit Flatscher - github.com/2b-t (2022)
+
+# @file test_matching_cost.py
+# @brief Testing routines for the optimised code paths of all registered matching costs against their reference implementation
+
+import numpy as np
+from parameterized import parameterized
+import unittest
+
+from batch_stereo_matching import BufferPool
+from matching_algorithm import WinnerTakesItAll
+from matching_cost import MatchingCost
+from test.reference import Reference
+
+
+class TestMatchingCost(unittest.TestCase):
+  # The cost volume computed by compute in double precision is the reference for every data type and code path
+  _combinations = [ [name + "_" + dtype_name, MatchingCost.from_name(name), dtype]
+                    for name in MatchingCost.names() for (dtype_name, dtype) in Reference.dtypes ]
+
+  def _get_cases(self, matching_cost: MatchingCost, dtype: type) -> list:
+    # Get the reference cost volumes of all image pairs and parameters
+    #   @param[in] matching_cost: The matching cost to be tested
+    #   @param[in] dtype: The data type the optimised code path is run with
+    #   @return: The name of the case, the left and right image converted to the data type, the parameters and the reference cost volume
+
+    if dtype not in matching_cost.supported_dtypes:
+      self.skipTest("Data type " + np.dtype(dtype).name + " not supported by matching cost '" + matching_cost.name + "'.")
+    cases = []
+    for (image_name, left_image, right_image) in Reference.image_pairs():
+      for (parameter_name, max_disparity, filter_radius) in Reference.parameters:
+        expected_volume = matching_cost.compute(left_image, right_image, max_disparity, filter_radius)
+        cases.append((image_name + "_" + parameter_name, left_image.astype(dtype), right_image.astype(dtype),
+                      max_disparity, filter_radius, expected_volume))
+    return cases
+
+  @parameterized.expand(_combinations)
+  def test_compute(self, name: str, matching_cost: MatchingCost, dtype: type) -> None:
+    # Parameterised unit test for testing if the cost volume of every supported data type matches the reference
+    #   @param[in] name: The name of the parameterised test
+    #   @param[in] matching_cost: The matching cost to be tested
+    #   @param[in] dtype: The data type to be tested
+
+    for (case, left_image, right_image, max_disparity, filter_radius, expected_volume) in self._get_cases(matching_cost, dtype):
+      with self.subTest(case):
+        cost_volume = matching_cost.compute(left_image, right_image, max_disparity, filter_radius)
+        self.assertEqual(cost_volume.dtype, dtype)
+        Reference.assert_cost_volume(cost_volume, expected_volume, dtype)
+    return
+
+  @parameterized.expand(_combinations)
+  def test_compute_wta(self, name: str, matching_cost: MatchingCost, dtype: type) -> None:
+    # Parameterised unit test for testing if the fused winner-takes-it-all search matches the search of the reference cost volume
+    #   @param[in] name: The name of the parameterised test
+    #   @param[in] matching_cost: The matching cost to be tested
+    #   @param[in] dtype: The data type to be tested
+
+    if not matching_cost.is_fusable:
+      self.skipTest("Matching cost '" + matching_cost.name + "' can't be fused.")
+    for (case, left_image, right_image, max_disparity, filter_radius, expected_volume) in self._get_cases(matching_cost, dtype):
+      with self.subTest(case):
+        disparity_image = matching_cost.compute_wta(left_image, right_image, max_disparity, filter_radius)
+        Reference.assert_disparity(disparity_image, WinnerTakesItAll.match(expected_volume), expected_volume, dtype)
+    return
+
+  @parameterized.expand(_combinations)
+  def test_compute_batch(self, name: str, matching_cost: MatchingCost, dtype: type) -> None:
+    # Parameterised unit test for testing if the batched cost volumes and winner-takes-it-all search match the reference
+    # The scratch buffers are reused between the image pairs and parameters so that stale values are detected
+    #   @param[in] name: The name of the parameterised test
+    #   @param[in] matching_cost: The matching cost to be tested
+    #   @param[in] dtype: The data type to be tested
+
+    buffer_pool = BufferPool()
+    for (case, left_image, right_image, max_disparity, filter_radius, expected_volume) in self._get_cases(matching_cost, dtype):
+      with self.subTest(case):
+        # The second pair is the first one mirrored so that all pairs of the stack differ
+        left_images = np.stack([left_image, np.ascontiguousarray(left_image[::-1])])
+        right_images = np.stack([right_image, np.ascontiguousarray(right_image[::-1])])
+        expected_volumes = [expected_volume, matching_cost.compute(left_images[1].astype(np.float64), right_images[1].astype(np.float64),
+                                                                   max_disparity, filter_radius)]
+        (N,H,W) = left_images.shape
+
+        cost_volumes = buffer_pool.get("cost_volumes", (N,H,W,max_disparity), dtype)
+        cost_volumes.fill(np.nan)
+        matching_cost.compute_batch(left_images, right_images, max_disparity, filter_radius, cost_volumes)
+        disparity_images = buffer_pool.get("disparity_images", (N,H,W), np.int64)
+        disparity_images.fill(-1)
+        matching_cost.compute_wta_batch(left_images, right_images, max_disparity, filter_radius, disparity_images)
+        for n in range(N):
+          Reference.assert_cost_volume(cost_volumes[n], expected_volumes[n], dtype)
+          Reference.assert_disparity(disparity_images[n], WinnerTakesItAll.match(expected_volumes[n]), expected_volumes[n], dtype)
+    return
+
+
+@unittest.skipUnless(Reference.is_timing, "Timing tests turned off")
+class TestMatchingCostTiming(unittest.TestCase):
+  # The optimised code paths are expected to be at least as fast as the reference on a single thread, their advantage is
+  # avoiding the cost volume and parallelising over all image pairs
+  _shape = (120, 160)
+  _batch_shape = (32, 24, 32)
+  _max_disparity = 8
+  _filter_radius = 2
+  _matching_costs = [ [name, MatchingCost.from_name(name)] for name in MatchingCost.names() ]
+
+  def _assert_speed_up(self, speed_up: float, expected_speed_up: float = 1.0) -> None:
+    # Assert that an optimised code path is not slower than expected
+    #   @param[in] speed_up: The measured speed-up over the reference
+    #   @param[in] expected_speed_up: The expected speed-up over the reference
+
+    self.assertGreaterEqual(speed_up, expected_speed_up/Reference.slack,
+                            "Optimised code path is slower than expected with a speed-up of " + str(round(speed_up, 2)) + ".")
+    return
+
+  @parameterized.expand(_matching_costs)
+  def test_compute_wta(self, name: str, matching_cost: MatchingCost) -> None:
+    # Parameterised unit test for testing if the fused winner-takes-it-all search is not slower than searching the cost volume
+    #   @param[in] name: The name of the parameterised test
+    #   @param[in] matching_cost: The matching cost to be tested
+
+    if not matching_cost.is_fusable:
+      self.skipTest("Matching cost '" + matching_cost.name + "' can't be fused.")
+    rng = np.random.default_rng(42)
+    left_image = rng.random(self._shape)
+    right_image = np.roll(left_image, 3, axis=1)
+
+    speed_up = Reference.speed_up(lambda: WinnerTakesItAll.match(matching_cost.compute(left_image, right_image, self._max_disparity, self._filter_radius)),
+                                  lambda: matching_cost.compute_wta(left_image, right_image, self._max_disparity, self._filter_radius))
+    self._assert_speed_up(speed_up)
+    return
+
+  @parameterized.expand(_matching_costs)
+  def test_compute_batch(self, name: str, matching_cost: MatchingCost) -> None:
+    # Parameterised unit test for testing if the batched kernels are not slower than processing one pair after another
+    #   @param[in] name: The name of the parameterised test
+    #   @param[in] matching_cost: The matching cost to be tested
+
+    rng = np.random.default_rng(42)
+    left_images = rng.random(self._batch_shape)
+    right_images = np.roll(left_images, 3, axis=2)
+    (N,H,W) = self._batch_shape
+    cost_volumes = np.empty((N,H,W,self._max_disparity))
+    disparity_images = np.empty((N,H,W), dtype=np.int64)
+
+    speed_up = Reference.speed_up(lambda: [matching_cost.compute(left_images[n], right_images[n], self._max_disparity, self._filter_radius) for n in range(N)],
+                                  lambda: matching_cost.compute_batch(left_images, right_images, self._max_disparity, self._filter_radius, cost_volumes))
+    self._assert_speed_up(speed_up)
+
+    if matching_cost.is_fusable:
+      speed_up = Reference.speed_up(lambda: [WinnerTakesItAll.match(matching_cost.compute(left_images[n], right_images[n], self._max_disparity, self._filter_radius)) for n in range(N)],
+                                    lambda: matching_cost.compute_wta_batch(left_images, right_images, self._max_disparity, self._filter_radius, disparity_images))
+      self._assert_speed_up(speed_up)
+    return
+
+
+if __name__ == '__main__':
+  unittest.main()
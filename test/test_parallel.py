@@ -0,0 +1,109 @@
+# Tobit Flatscher - github.com/2b-t (2022)
+
+# @file test_parallel.py
+# @brief Testing routines for the parallel backends of stereo matching
+
+import gc
+import numpy as np
+from parameterized import parameterized
+import unittest
+from unittest import mock
+
+from matching_algorithm import SemiGlobalMatching, WinnerTakesItAll
+from matching_cost import NormalisedCrossCorrelation, SumOfAbsoluteDifferences, SumOfSquaredDifferences
+from parallel import Backend, Parallel
+from stereo_matching import StereoMatching
+
+
+class TestParallel(unittest.TestCase):
+  _shape = (30, 40)
+  _max_disparity = 6
+  _filter_radius = 2
+  _backends = [ ["numba",     Backend.NUMBA],
+                ["threads",   Backend.THREADS],
+                ["processes", Backend.PROCESSES]
+              ]
+
+  @parameterized.expand(_backends)
+  def test_same_result(self, name: str, backend: Backend) -> None:
+    # Parameterised unit test for testing if all backends result in the same disparity image as a single numba thread
+    #   @param[in] name: The name of the parameterised test
+    #   @param[in] backend: The parallel backend to be tested
+
+    num_threads = 3
+    if backend == Backend.NUMBA:
+      num_threads = Parallel.max_threads()
+    rng = np.random.default_rng(42)
+    left_image = rng.random(self._shape)
+    right_image = np.roll(left_image, 3, axis=1)
+
+    for matching_cost in [NormalisedCrossCorrelation, SumOfAbsoluteDifferences, SumOfSquaredDifferences]:
+      sm = StereoMatching(left_image, right_image, matching_cost, WinnerTakesItAll, self._max_disparity, self._filter_radius, None, 1, Backend.NUMBA)
+      sm.compute()
+      expected_result = sm.result()
+      with StereoMatching(left_image, right_image, matching_cost, WinnerTakesItAll, self._max_disparity, self._filter_radius, None, num_threads, backend) as sm:
+        sm.compute()
+        np.testing.assert_array_equal(sm.result(), expected_result)
+    return
+
+  @parameterized.expand(_backends[1:])
+  def test_reuse_pool(self, name: str, backend: Backend) -> None:
+    # Parameterised unit test for testing if the pool is started once for repeated computations and shut down when closing
+    #   @param[in] name: The name of the parameterised test
+    #   @param[in] backend: The parallel backend to be tested
+
+    rng = np.random.default_rng(42)
+    left_image = rng.random(self._shape)
+    right_image = np.roll(left_image, 3, axis=1)
+
+    with mock.patch.object(Parallel, "executor", wraps=Parallel.executor) as executor:
+      sm = StereoMatching(left_image, right_image, SumOfAbsoluteDifferences, WinnerTakesItAll, self._max_disparity, self._filter_radius, None, 2, backend)
+      with sm:
+        sm.compute()
+        expected_result = sm.result()
+        sm.compute()
+        np.testing.assert_array_equal(sm.result(), expected_result)
+        self.assertEqual(executor.call_count, 1)
+      self.assertIsNone(sm._executor)
+    return
+
+  @parameterized.expand(_backends[1:])
+  def test_shutdown_pool(self, name: str, backend: Backend) -> None:
+    # Parameterised unit test for testing if the pool of an object that is not closed is shut down once it is garbage collected
+    #   @param[in] name: The name of the parameterised test
+    #   @param[in] backend: The parallel backend to be tested
+
+    image = np.random.default_rng(42).random(self._shape)
+    sm = StereoMatching(image, image, SumOfAbsoluteDifferences, WinnerTakesItAll, self._max_disparity, self._filter_radius, None, 2, backend)
+    sm.compute()
+    executor = sm._executor
+    del sm
+    gc.collect()
+    self.assertRaises(RuntimeError, executor.submit, int)
+    return
+
+  @parameterized.expand(_backends[1:])
+  def test_not_streamable(self, name: str, backend: Backend) -> None:
+    # Parameterised unit test for testing if the pools refuse matching algorithms that can't be split into strips
+    #   @param[in] name: The name of the parameterised test
+    #   @param[in] backend: The parallel backend to be tested
+
+    image = np.zeros(self._shape)
+    sm = StereoMatching(image, image, SumOfAbsoluteDifferences, SemiGlobalMatching, self._max_disparity, self._filter_radius, None, 2, backend)
+    self.assertRaises(ValueError, sm.plan)
+    return
+
+  def test_invalid_number_of_threads(self) -> None:
+    # Function for testing if invalid numbers of threads and threading layers result in a ValueError
+
+    image = np.zeros(self._shape)
+    self.assertRaises(ValueError, StereoMatching, image, image, SumOfAbsoluteDifferences, WinnerTakesItAll,
+                      self._max_disparity, self._filter_radius, None, 0, Backend.NUMBA)
+    self.assertRaises(ValueError, StereoMatching, image, image, SumOfAbsoluteDifferences, WinnerTakesItAll,
+                      self._max_disparity, self._filter_radius, None, Parallel.max_threads() + 1, Backend.NUMBA)
+    self.assertRaises(ValueError, Parallel.set_threading_layer, "xyz")
+    return
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,230 @@
+# Tobit Flatscher - github.com/2b-t (2022)
+
+# @file test_service.py
+# @brief Testing routines for the stereo matching service and its client
+
+import http.client
+import json
+from multiprocessing import shared_memory
+import numpy as np
+from parameterized import parameterized
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from matching_algorithm import MatchingAlgorithm
+from matching_cost import MatchingCost
+from service import ServiceMetrics, StereoClient, StereoService
+from stereo_matching import StereoMatching
+
+
+class TestStereoService(unittest.TestCase):
+  _shape = (3, 16, 20)
+  _max_disparity = 5
+  _filter_radius = 2
+
+  @classmethod
+  def setUpClass(cls) -> None:
+    cls._directory = tempfile.TemporaryDirectory()
+    cls._socket_path = os.path.join(cls._directory.name, "stereo.sock")
+    cls._service = StereoService(num_workers = 2)
+    cls._service.serve_unix(cls._socket_path)
+    cls._port = cls._service.serve_http(0).server_address[1]
+    return
+
+  @classmethod
+  def tearDownClass(cls) -> None:
+    cls._service.shutdown()
+    cls._directory.cleanup()
+    return
+
+  def _get_client(self, transport: str) -> StereoClient:
+    # Connect a client to the service
+    #   @param[in] transport: The transport to be used, either unix or http
+    #   @return: The client
+
+    if transport == "unix":
+      return StereoClient(socket_path = self._socket_path)
+    return StereoClient(port = self._port)
+
+  @parameterized.expand([["unix"], ["http"]])
+  def test_same_result(self, transport: str) -> None:
+    # Parameterised unit test for testing if the service results in the same disparity images as stereo matching in the same process
+    #   @param[in] transport: The transport to be tested
+
+    rng = np.random.default_rng(42)
+    left_images = rng.random(self._shape)
+    right_images = np.roll(left_images, 2, axis=2)
+
+    with self._get_client(transport) as client:
+      for matching_cost_name in MatchingCost.names():
+        for matching_algorithm_name in MatchingAlgorithm.names():
+          sm = StereoMatching(left_images[0], right_images[0], MatchingCost.from_name(matching_cost_name),
+                              MatchingAlgorithm.from_name(matching_algorithm_name), self._max_disparity, self._filter_radius)
+          sm.compute()
+          disparity_image = client.match(left_images[0], right_images[0], matching_cost_name, matching_algorithm_name,
+                                         self._max_disparity, self._filter_radius)
+          np.testing.assert_array_equal(disparity_image, sm.result())
+          disparity_images = client.match(left_images, right_images, matching_cost_name, matching_algorithm_name,
+                                          self._max_disparity, self._filter_radius)
+          np.testing.assert_array_equal(disparity_images[0], sm.result())
+    return
+
+  def test_errors_and_metrics(self) -> None:
+    # Unit test for testing if failed requests are reported to the client and counted by the metrics
+
+    image = np.zeros((8, 8))
+    with self._get_client("unix") as client:
+      failed = client.metrics()["failed"]
+      with self.assertRaises(RuntimeError):
+        client.match(image, image, "unknown", "WTA", self._max_disparity, self._filter_radius)
+      with self.assertRaises(RuntimeError):
+        client.match(image, image, "SAD", "WTA", 0, self._filter_radius)
+      metrics = client.metrics()
+    self.assertEqual(metrics["failed"], failed + 2)
+    self.assertEqual(metrics["queue_depth"], 0)
+    self.assertEqual(metrics["running"], 0)
+    self.assertIsNotNone(metrics["latency_ms"]["p99"])
+    return
+
+  @parameterized.expand([["unix"], ["http"]])
+  def test_invalid_request(self, transport: str) -> None:
+    # Parameterised unit test for testing if requests that are no JSON object are answered with an error and the connection is kept
+    #   @param[in] transport: The transport to be tested
+
+    if transport == "unix":
+      with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(self._socket_path)
+        with connection.makefile("rwb") as f:
+          for line in [b"[1]\n", b"not json\n", b'{"command": "ping"}\n']:
+            f.write(line)
+            f.flush()
+            response = json.loads(f.readline())
+            self.assertEqual(response["status"], "ok" if b"ping" in line else "error")
+    else:
+      connection = http.client.HTTPConnection("127.0.0.1", self._port)
+      try:
+        for body in [b"[1]", b"not json", b'{"command": "ping"}']:
+          connection.request("POST", "/", body)
+          response = connection.getresponse()
+          self.assertEqual(json.loads(response.read())["status"], "ok" if b"ping" in body else "error")
+          self.assertEqual(response.status, 200 if b"ping" in body else 400)
+      finally:
+        connection.close()
+    return
+
+  def test_shared_buffer_pool(self) -> None:
+    # Unit test for testing if the stacks of different requests of a worker share a single pool of scratch buffers
+
+    bsm = self._service._get_batch_stereo_matching(MatchingCost.from_name("SAD"), MatchingAlgorithm.from_name("SGM"), self._max_disparity, self._filter_radius)
+    other_bsm = self._service._get_batch_stereo_matching(MatchingCost.from_name("NCC"), MatchingAlgorithm.from_name("SGM"), self._max_disparity + 1, self._filter_radius)
+    self.assertIs(bsm.buffer_pool(), other_bsm.buffer_pool())
+
+    rng = np.random.default_rng(42)
+    left_images = rng.random(self._shape)
+    right_images = np.roll(left_images, 2, axis=2)
+    bsm.compute(left_images, right_images)
+    size = bsm.buffer_pool().size()
+    other_bsm.compute(left_images, right_images)
+    bsm.compute(left_images, right_images)
+    self.assertEqual(bsm.buffer_pool().size(), size)
+    return
+
+  def test_invalid_arguments(self) -> None:
+    # Unit test for testing if invalid arguments of the service and the client are rejected
+
+    with self.assertRaises(ValueError):
+      StereoService(num_workers = 0)
+    with self.assertRaises(ValueError):
+      StereoClient()
+    with self.assertRaises(ValueError):
+      StereoClient(socket_path = self._socket_path, port = self._port)
+    return
+
+
+class TestStereoServiceProcess(unittest.TestCase):
+  # The service runs in a separate process so that it attaches to the shared memory of the client without owning it
+  _shape = (2, 16, 20)
+  _max_disparity = 5
+  _filter_radius = 2
+  _timeout = 300.0
+  _service_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "service.py")
+
+  def test_shared_memory_survives_service(self) -> None:
+    # Function for testing if a service in another process results in the same disparity images and does not unlink
+    # the shared memory of the client when it exits
+
+    rng = np.random.default_rng(42)
+    left_images = rng.random(self._shape)
+    right_images = np.roll(left_images, 2, axis=2)
+
+    with tempfile.TemporaryDirectory() as directory:
+      socket_path = os.path.join(directory, "stereo.sock")
+      process = subprocess.Popen([sys.executable, self._service_path, "-s", socket_path, "-w", "1"],
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+      try:
+        # The service creates the socket after compiling the kernels
+        deadline = time.monotonic() + self._timeout
+        while not os.path.exists(socket_path):
+          if process.poll() is not None:
+            self.fail("Service exited with code " + str(process.returncode) + ": " + process.stderr.read().decode())
+          if time.monotonic() > deadline:
+            self.fail("Service did not start within " + str(self._timeout) + " s.")
+          time.sleep(0.1)
+
+        with StereoClient(socket_path = socket_path) as client:
+          disparity_images = client.match(left_images, right_images, "SAD", "WTA", self._max_disparity, self._filter_radius)
+          disparity_image = client.match(left_images[0], right_images[0], "SAD", "WTA", self._max_disparity, self._filter_radius)
+          for n in range(self._shape[0]):
+            sm = StereoMatching(left_images[n], right_images[n], MatchingCost.from_name("SAD"), MatchingAlgorithm.from_name("WTA"),
+                                self._max_disparity, self._filter_radius)
+            sm.compute()
+            np.testing.assert_array_equal(disparity_images[n], sm.result())
+          np.testing.assert_array_equal(disparity_image, disparity_images[0])
+
+          # Reading the error output waits for the resource tracker of the service as well, which would unlink the
+          # shared memory it tracks after the service exited
+          process.send_signal(signal.SIGINT)
+          process.wait(self._timeout)
+          self.assertNotIn("leaked shared_memory", process.stderr.read().decode())
+          names = [segment.name for segment in client._segments.values()]
+          self.assertEqual(len(names), 3)
+          for name in names:
+            segment = shared_memory.SharedMemory(name = name)
+            segment.close()
+      finally:
+        if process.poll() is None:
+          process.kill()
+          process.wait()
+        process.stderr.close()
+    return
+
+
+class TestServiceMetrics(unittest.TestCase):
+  def test_metrics(self) -> None:
+    # Unit test for testing the counters and latencies of the metrics
+
+    metrics = ServiceMetrics(window = 2)
+    self.assertIsNone(metrics.to_dict()["latency_ms"]["mean"])
+    for latency in [1.0, 0.002, 0.004]:
+      metrics.submit()
+      metrics.start(0.0)
+      metrics.finish(latency, latency < 1.0)
+    metrics.submit()
+    result = metrics.to_dict()
+    self.assertEqual(result["queue_depth"], 1)
+    self.assertEqual(result["running"], 0)
+    self.assertEqual(result["completed"], 2)
+    self.assertEqual(result["failed"], 1)
+    self.assertAlmostEqual(result["latency_ms"]["mean"], 3.0)
+    self.assertAlmostEqual(result["latency_ms"]["max"], 4.0)
+    return
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,291 @@
+# Tobit Flatscher - github.com/2b-t (2022)
+
+# @file test_stereo_matching.py
+# @brief Testing routines for the registry of matching costs and algorithms, the execution planner and memory budget
+#        as well as all pipelines and backends against the reference implementations
+
+import numpy as np
+from parameterized import parameterized
+import unittest
+from unittest import mock
+
+from matching_algorithm import MatchingAlgorithm, SemiGlobalMatching, WinnerTakesItAll
+from matching_cost import MatchingCost, NormalisedCrossCorrelation, SumOfAbsoluteDifferences, SumOfSquaredDifferences
+from parallel import Backend, Parallel
+from stereo_matching import Pipeline, Plan, StereoMatching
+from test.reference import Reference
+from utilities import PeakMemory
+
+
+class _UnfusedSumOfAbsoluteDifferences(SumOfAbsoluteDifferences):
+  # Sum of absolute differences without fused kernel, not registered as it does not set its own name
+  is_fusable = False
+  compute_wta = staticmethod(MatchingCost.compute_wta)
+
+
+class _HwdNormalisedCrossCorrelation(NormalisedCrossCorrelation):
+  # Normalised cross-correlation declaring the layout of the matching algorithms, not registered as it does not set its own name
+  volume_layout = "HWD"
+
+
+class TestRegistry(unittest.TestCase):
+
+  def test_matching_cost_names(self) -> None:
+    # Function for testing if all matching costs are registered under their short names
+
+    self.assertEqual(MatchingCost.names(), ["NCC", "SAD", "SSD"])
+    self.assertIs(MatchingCost.from_name("NCC"), NormalisedCrossCorrelation)
+    self.assertIs(MatchingCost.from_name("SAD"), SumOfAbsoluteDifferences)
+    self.assertIs(MatchingCost.from_name("SSD"), SumOfSquaredDifferences)
+    self.assertRaises(ValueError, MatchingCost.from_name, "XYZ")
+    return
+
+  def test_matching_cost_is_fusable(self) -> None:
+    # Function for testing if a matching cost has to implement compute_wta if and only if it declares to be fusable
+
+    self.assertFalse(_UnfusedSumOfAbsoluteDifferences.is_fusable)
+    self.assertRaises(NotImplementedError, _UnfusedSumOfAbsoluteDifferences.compute_wta, np.zeros((8,8)), np.zeros((8,8)), 2, 1)
+    with self.assertRaises(ValueError):
+      class _FusableWithoutComputeWta(MatchingCost):
+        is_fusable = True
+        compute = SumOfAbsoluteDifferences.compute
+    with self.assertRaises(ValueError):
+      class _NotFusableWithComputeWta(SumOfAbsoluteDifferences):
+        is_fusable = False
+    return
+
+  def test_matching_algorithm_names(self) -> None:
+    # Function for testing if all matching algorithms are registered under their short names
+
+    self.assertEqual(MatchingAlgorithm.names(), ["SGM", "WTA"])
+    self.assertIs(MatchingAlgorithm.from_name("SGM"), SemiGlobalMatching)
+    self.assertIs(MatchingAlgorithm.from_name("WTA"), WinnerTakesItAll)
+    self.assertRaises(ValueError, MatchingAlgorithm.from_name, "XYZ")
+    return
+
+
+class TestStereoMatching(unittest.TestCase):
+  _shape = (24, 32)
+  _max_disparity = 6
+  _filter_radius = 2
+  _matching_costs = [ ["NCC", NormalisedCrossCorrelation],
+                      ["SAD", SumOfAbsoluteDifferences],
+                      ["SSD", SumOfSquaredDifferences]
+                    ]
+
+  @parameterized.expand(_matching_costs)
+  def test_plan(self, name: str, matching_cost: MatchingCost) -> None:
+    # Parameterised unit test for testing if winner-takes-it-all is fused into the matching cost while semi-global matching is not
+    #   @param[in] name: The name of the parameterised test
+    #   @param[in] matching_cost: The matching cost to be tested
+
+    image = np.zeros(self._shape)
+    sm = StereoMatching(image, image, matching_cost, WinnerTakesItAll, self._max_disparity, self._filter_radius)
+    self.assertEqual(sm.plan().pipeline, Pipeline.FUSED)
+    self.assertEqual(sm.plan().dtype, np.float64)
+    sm = StereoMatching(image, image, matching_cost, SemiGlobalMatching, self._max_disparity, self._filter_radius)
+    self.assertEqual(sm.plan().pipeline, Pipeline.VOLUME)
+    self.assertEqual(sm.plan().dtype, np.float64)
+    return
+
+  @parameterized.expand(_matching_costs)
+  def test_plan_memory_budget(self, name: str, matching_cost: MatchingCost) -> None:
+    # Parameterised unit test for testing if a tight memory budget results in a smaller data type and a too small one in an error
+    #   @param[in] name: The name of the parameterised test
+    #   @param[in] matching_cost: The matching cost to be tested
+
+    image = np.zeros(self._shape)
+    sm = StereoMatching(image, image, matching_cost, SemiGlobalMatching, self._max_disparity, self._filter_radius)
+    memory = sm.plan().estimated_memory
+    sm = StereoMatching(image, image, matching_cost, SemiGlobalMatching, self._max_disparity, self._filter_radius, memory - 1)
+    self.assertEqual(sm.plan().pipeline, Pipeline.VOLUME)
+    self.assertEqual(sm.plan().dtype, np.float32)
+    self.assertLessEqual(sm.plan().estimated_memory, memory - 1)
+    sm = StereoMatching(image, image, matching_cost, SemiGlobalMatching, self._max_disparity, self._filter_radius, 1024)
+    self.assertRaises(MemoryError, sm.plan)
+    return
+
+  def test_plan_memory_budget_fused(self) -> None:
+    # Function for testing if a too small memory budget for the fused pipeline reports the memory of the unsplit image
+    # as splitting it into strips only adds the disparity images of the strips
+
+    image = np.zeros((375, 450))
+    sm = StereoMatching(image, image, SumOfAbsoluteDifferences, WinnerTakesItAll, 60, self._filter_radius)
+    memory = sm.plan().estimated_memory
+    sm = StereoMatching(image, image, SumOfAbsoluteDifferences, WinnerTakesItAll, 60, self._filter_radius, memory - 1)
+    with self.assertRaisesRegex(MemoryError, "at least " + PeakMemory.str_megabytes(memory)):
+      sm.plan()
+    return
+
+  def test_volume_layout(self) -> None:
+    # Function for testing if a cost volume assembled in a different memory layout is converted into the one of the
+    # matching algorithm and the conversion is included in the estimated memory
+
+    rng = np.random.default_rng(42)
+    left_image = rng.random(self._shape)
+    right_image = np.roll(left_image, 3, axis=1)
+    self.assertNotEqual(NormalisedCrossCorrelation.volume_layout, SemiGlobalMatching.volume_layout)
+
+    sm = StereoMatching(left_image, right_image, _HwdNormalisedCrossCorrelation, SemiGlobalMatching, self._max_disparity, self._filter_radius)
+    memory = sm.plan().estimated_memory
+    sm = StereoMatching(left_image, right_image, NormalisedCrossCorrelation, SemiGlobalMatching, self._max_disparity, self._filter_radius)
+    self.assertEqual(sm.plan().estimated_memory, memory + np.prod(self._shape)*self._max_disparity*np.dtype(np.float64).itemsize)
+    sm.compute()
+    self.assertTrue(sm._cost_volume.flags["C_CONTIGUOUS"])
+    cost_volume = NormalisedCrossCorrelation.compute(left_image, right_image, self._max_disparity, self._filter_radius)
+    np.testing.assert_array_equal(sm._cost_volume, cost_volume)
+    np.testing.assert_array_equal(sm.result(), SemiGlobalMatching.match(cost_volume))
+    return
+
+  def test_streamed(self) -> None:
+    # Function for testing if a memory budget results in a streamed pipeline for matching costs that can't be fused
+    # and that the strips result in the same disparity image as the full cost volume
+
+    rng = np.random.default_rng(42)
+    left_image = rng.random(self._shape)
+    right_image = np.roll(left_image, 3, axis=1)
+
+    sm = StereoMatching(left_image, right_image, _UnfusedSumOfAbsoluteDifferences, WinnerTakesItAll, self._max_disparity, self._filter_radius)
+    self.assertEqual(sm.plan().pipeline, Pipeline.VOLUME)
+    sm.compute()
+    expected_result = sm.result()
+
+    memory_budget = sm.plan().estimated_memory//2
+    sm = StereoMatching(left_image, right_image, _UnfusedSumOfAbsoluteDifferences, WinnerTakesItAll, self._max_disparity, self._filter_radius, memory_budget)
+    plan = sm.plan()
+    self.assertEqual(plan.pipeline, Pipeline.STREAMED)
+    self.assertLess(plan.strip_height, self._shape[0])
+    self.assertLessEqual(plan.estimated_memory, memory_budget)
+    sm.compute()
+    np.testing.assert_array_equal(sm.result(), expected_result)
+    return
+
+  def test_measure_memory(self) -> None:
+    # Function for testing if the peak memory of the process is only reset and measured when asked for
+
+    image = np.zeros(self._shape)
+    with mock.patch("stereo_matching.PeakMemory") as peak_memory:
+      sm = StereoMatching(image, image, SumOfAbsoluteDifferences, WinnerTakesItAll, self._max_disparity, self._filter_radius)
+      sm.compute()
+      peak_memory.assert_not_called()
+      self.assertIsNone(sm.peak_memory())
+
+      peak_memory.return_value.__enter__.return_value.result.return_value = 1024
+      sm = StereoMatching(image, image, SumOfAbsoluteDifferences, WinnerTakesItAll, self._max_disparity, self._filter_radius,
+                          measure_memory = True)
+      sm.compute()
+      peak_memory.assert_called_once()
+      self.assertEqual(sm.peak_memory(), 1024)
+    return
+
+  @parameterized.expand(_matching_costs)
+  def test_fused_winner_takes_it_all(self, name: str, matching_cost: MatchingCost) -> None:
+    # Parameterised unit test for testing if the fused pipeline results in the same disparity image as the cost volume
+    #   @param[in] name: The name of the parameterised test
+    #   @param[in] matching_cost: The matching cost to be tested
+
+    # Few grey levels result in ties between disparities
+    rng = np.random.default_rng(42)
+    left_image = rng.integers(0, 4, self._shape)/4
+    right_image = np.roll(left_image, 3, axis=1)
+
+    cost_volume = matching_cost.compute(left_image, right_image, self._max_disparity, self._filter_radius)
+    expected_result = WinnerTakesItAll.match(cost_volume)
+    sm = StereoMatching(left_image, right_image, matching_cost, WinnerTakesItAll, self._max_disparity, self._filter_radius)
+    sm.compute()
+    np.testing.assert_array_equal(sm.result(), expected_result)
+    return
+
+  @parameterized.expand(_matching_costs)
+  def test_flat_window(self, name: str, matching_cost: MatchingCost) -> None:
+    # Parameterised unit test for testing if windows without texture result in a finite cost and the same disparity image
+    # for the fused pipeline as for the cost volume, also when being called repeatedly
+    #   @param[in] name: The name of the parameterised test
+    #   @param[in] matching_cost: The matching cost to be tested
+
+    rng = np.random.default_rng(42)
+    left_image = rng.random(self._shape)
+    left_image[5:15, 5:20] = 0.5
+    right_image = np.roll(left_image, 3, axis=1)
+
+    cost_volume = matching_cost.compute(left_image, right_image, self._max_disparity, self._filter_radius)
+    self.assertTrue(np.all(np.isfinite(cost_volume)))
+    expected_result = WinnerTakesItAll.match(cost_volume)
+    for _ in range(2):
+      sm = StereoMatching(left_image, right_image, matching_cost, WinnerTakesItAll, self._max_disparity, self._filter_radius)
+      self.assertEqual(sm.plan().pipeline, Pipeline.FUSED)
+      sm.compute()
+      np.testing.assert_array_equal(sm.result(), expected_result)
+    return
+
+
+def _get_pipelines() -> list:
+  # Get all combinations of registered matching costs and algorithms with the pipelines and backends they can be run with
+  # Spawning the pool of processes is slow, therefore the process backend is only combined with a single matching cost
+  #   @return: The name of the combination, the matching cost, the matching algorithm, the pipeline and the backend
+
+  combinations = []
+  for matching_cost_name in MatchingCost.names():
+    for matching_algorithm_name in MatchingAlgorithm.names():
+      matching_cost = MatchingCost.from_name(matching_cost_name)
+      matching_algorithm = MatchingAlgorithm.from_name(matching_algorithm_name)
+      pipelines = [Pipeline.VOLUME]
+      if matching_cost.is_fusable and matching_algorithm.is_fusable:
+        pipelines.append(Pipeline.FUSED)
+      if matching_cost.is_streamable and matching_algorithm.is_streamable:
+        pipelines.append(Pipeline.STREAMED)
+      for pipeline in pipelines:
+        for backend in Backend:
+          if (pipeline == Pipeline.VOLUME) and (backend != Backend.NUMBA):
+            continue
+          if (backend == Backend.PROCESSES) and (matching_cost_name != MatchingCost.names()[0]):
+            continue
+          name = "_".join([matching_cost_name, matching_algorithm_name, pipeline.value, backend.value])
+          combinations.append([name, matching_cost, matching_algorithm, pipeline, backend])
+  return combinations
+
+
+class TestPipelines(unittest.TestCase):
+  # The reference is the reference matching algorithm searching the cost volume of the reference matching cost in double precision
+  _strip_height = 5
+  _num_threads = 2
+
+  @parameterized.expand(_get_pipelines())
+  def test_same_result(self, name: str, matching_cost: MatchingCost, matching_algorithm: MatchingAlgorithm,
+                       pipeline: Pipeline, backend: Backend) -> None:
+    # Parameterised unit test for testing if every pipeline and backend results in the reference disparity image for every data type
+    #   @param[in] name: The name of the parameterised test
+    #   @param[in] matching_cost: The matching cost to be tested
+    #   @param[in] matching_algorithm: The matching algorithm to be tested
+    #   @param[in] pipeline: The pipeline to be tested
+    #   @param[in] backend: The parallel backend to be tested
+
+    dtypes = matching_cost.supported_dtypes
+    if pipeline != Pipeline.FUSED:
+      dtypes = tuple(t for t in dtypes if t in matching_algorithm.supported_dtypes)
+    num_threads = self._num_threads
+    if backend == Backend.NUMBA:
+      num_threads = Parallel.max_threads()
+    image_pairs = Reference.image_pairs()
+    parameters = Reference.parameters
+    if backend == Backend.PROCESSES:
+      image_pairs = image_pairs[-1:]
+      parameters = parameters[-2:-1]
+
+    for dtype in dtypes:
+      for (image_name, left_image, right_image) in image_pairs:
+        for (parameter_name, max_disparity, filter_radius) in parameters:
+          with self.subTest(dtype = np.dtype(dtype).name, image = image_name, parameters = parameter_name):
+            cost_volume = matching_cost.compute(left_image, right_image, max_disparity, filter_radius)
+            expected_result = matching_algorithm.match(cost_volume)
+            strip_height = left_image.shape[0] if pipeline == Pipeline.VOLUME else self._strip_height
+            with StereoMatching(left_image, right_image, matching_cost, matching_algorithm, max_disparity, filter_radius,
+                                None, num_threads, backend) as sm:
+              with mock.patch.object(sm, "plan", return_value = Plan(pipeline, dtype, strip_height, 0)):
+                sm.compute()
+            Reference.assert_disparity(sm.result(), expected_result, matching_algorithm.aggregate(cost_volume), dtype)
+    return
+
+
+if __name__ == '__main__':
+  unittest.main()